@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import namedtuple
+
+import numpy
+import serial
+
+from sensor import DORIENT_FIELDS, Sensor, scan_ports
+
+
+Throughput = namedtuple('Throughput', ('frames', 'bytes'))
+
+
+class Acquisition(object):
+    """ This class used to read several sensors at once, one reader thread per port
+
+    Every port gets its own Sensor with its own ring buffer, frames are
+    timestamped by time.monotonic() when they are received. Raw frames of
+    all ports go to recorder (recording.RecordWriter) if it is given.
+    """
+
+    def __init__(self, ports, timeout=0.1, buffer_size=Sensor.BUFFER_SIZE, bus_factory=serial.Serial,
+                 recorder=None):
+        self.ports = list(ports)
+        self.timeout = timeout
+        self.buffer_size = buffer_size
+        self.bus_factory = bus_factory
+        self.recorder = recorder
+
+        self.sensors = {}
+        self._buses = {}
+        self._threads = {}
+        self._mark = None
+
+    @classmethod
+    def scan(cls, **kwargs):
+        """ Create acquisition for every available serial port """
+        return cls(scan_ports(), **kwargs)
+
+    @property
+    def running(self):
+        return any(t.is_alive() for t in self._threads.values())
+
+    def start(self):
+        try:
+            for port_id, port in enumerate(self.ports):
+                bus = self._buses[port] = self.bus_factory(port, timeout=self.timeout)
+                self.sensors[port] = Sensor(
+                    bus, buffer_size=self.buffer_size, recorder=self.recorder, port_id=port_id)
+        except serial.SerialException:
+            self.stop()
+            raise
+
+        for port, sensor in self.sensors.items():
+            t = threading.Thread(target=sensor.run, name="sensor {}".format(port), daemon=True)
+            t.start()
+            self._threads[port] = t
+        self._mark = (time.monotonic(), self._counters())
+
+    def stop(self):
+        for sensor in self.sensors.values():
+            sensor.terminate()
+        for t in self._threads.values():
+            t.join(timeout=2 * self.timeout)
+        for bus in self._buses.values():
+            bus.close()
+        self._threads = {}
+        self._buses = {}
+        self.sensors = {}
+
+    def drain(self):
+        """ Return {port: (timestamps, frames)} of every frame received since the previous call """
+        return {port: sensor.drain() for port, sensor in self.sensors.items()}
+
+    def drain_all(self):
+        """ Return (port_ids, timestamps, frames) of all ports merged in order of reception
+
+        port_ids are indexes in self.ports. Arrays are empty without running sensors.
+        """
+        port_ids, times, frames = [], [], []
+        for port_id, port in enumerate(self.ports):
+            if port not in self.sensors:
+                continue
+            t, f = self.sensors[port].drain()
+            port_ids.append(numpy.full(len(t), port_id, dtype=numpy.uint8))
+            times.append(t)
+            frames.append(f)
+        if not times:
+            return numpy.empty(0, dtype=numpy.uint8), numpy.empty(0), numpy.empty((0, DORIENT_FIELDS))
+        times = numpy.concatenate(times)
+        order = numpy.argsort(times, kind='stable')
+        return numpy.concatenate(port_ids)[order], times[order], numpy.concatenate(frames)[order]
+
+    def throughput(self):
+        """ Return ({port: Throughput}, total Throughput) per second since the previous call """
+        now, counters = time.monotonic(), self._counters()
+        then, previous = self._mark
+        self._mark = (now, counters)
+
+        elapsed = max(now - then, 1e-9)
+        result = {}
+        for port, (frames, nbytes) in counters.items():
+            frames0, nbytes0 = previous.get(port, (0, 0))
+            result[port] = Throughput((frames - frames0) / elapsed, (nbytes - nbytes0) / elapsed)
+        total = Throughput(sum(t.frames for t in result.values()), sum(t.bytes for t in result.values()))
+        return result, total
+
+    def _counters(self):
+        return {port: (sensor.buffer.received, sensor.bytes_received) for port, sensor in self.sensors.items()}
@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+import serial
+
+from sensor import DorientDecoder, logger
+
+
+class SensorProtocol(asyncio.Protocol):
+    """ Decode DORIENT frames as bytes arrive on a non-blocking pipe, tty or socket
+
+    Decoded batches are queued as (timestamp, frames). Reading is paused
+    while the consumer is HIGH_WATER batches behind.
+    """
+    HIGH_WATER = 64
+
+    def __init__(self):
+        self.decoder = DorientDecoder()
+        self.batches = asyncio.Queue()
+        self.transport = None
+        self._paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        received = time.monotonic()
+        frames = self.decoder.decode(data)
+        if not len(frames):
+            return
+
+        self.batches.put_nowait((received, frames))
+        if not self._paused and self.batches.qsize() >= self.HIGH_WATER:
+            self._paused = True
+            self.transport.pause_reading()
+
+    def connection_lost(self, exc):
+        if exc is not None:
+            logger.error("sensor connection lost: %s", exc)
+        self.batches.put_nowait(None)
+
+    async def get(self):
+        """ Return next (timestamp, frames) batch or None when connection is closed """
+        batch = await self.batches.get()
+        if self._paused and self.batches.qsize() < self.HIGH_WATER // 2:
+            self._paused = False
+            self.transport.resume_reading()
+        return batch
+
+
+class AsyncSensor(object):
+    """ asyncio counterpart of sensor.Sensor
+
+        async with AsyncSensor(pipe) as sensor:
+            async for timestamp, frame in sensor.frames():
+                ...
+
+    pipe is any object with fileno() (serial port, pty, pipe or socket),
+    it is closed together with the sensor.
+    """
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.transport = None
+        self.protocol = None
+
+    @classmethod
+    def open_port(cls, port, **kwargs):
+        return cls(serial.Serial(port, timeout=0, **kwargs))
+
+    @property
+    def errors(self):
+        return self.protocol.decoder.errors
+
+    @property
+    def bytes_received(self):
+        return self.protocol.decoder.bytes_received
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self.transport, self.protocol = await loop.connect_read_pipe(SensorProtocol, self.pipe)
+        return self
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    async def batches(self):
+        """ Yield (timestamp, frames) with every frame decoded from one read """
+        while True:
+            batch = await self.protocol.get()
+            if batch is None:
+                return
+            yield batch
+
+    async def frames(self):
+        """ Yield (timestamp, frame) for every DORIENT frame """
+        async for received, frames in self.batches():
+            for frame in frames:
+                yield received, frame
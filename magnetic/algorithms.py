@@ -1,6 +1,11 @@
+import functools
+import logging
 import math
 from math import cos, sin
-from operator import itemgetter
+
+import numpy
+
+logger = logging.getLogger("algorithms")
 
 
 def to_horizont(y, x, z, roll_grad, pitch_grad):
@@ -20,17 +25,105 @@ def to_horizont(y, x, z, roll_grad, pitch_grad):
     return yh, xh, zh
 
 
-class FixTable(object):
-    def __init__(self, xoffset, yoffset, a, b , c , d, clockwise):
-        self.x_offset = xoffset
-        self.y_offset = yoffset
-        self.A = a
-        self.B = b
-        self.C = c
-        self.D = d
-        self.clockwise = clockwise
+# Sensor reports angles in steps of 359.9/65536 grad
+ANGLE_STEP = 359.9 / 65536.0
 
-    def compensate(self, x, y):
+
+class TrigTable(object):
+    """ sin/cos of every angle the sensor can report, for tilt compensation of quantized angles """
+
+    def __init__(self):
+        radians = numpy.radians(numpy.arange(-32768, 32769) * ANGLE_STEP)
+        self.sin = numpy.sin(radians)
+        self.cos = numpy.cos(radians)
+
+    def lookup(self, grad):
+        """ Return (sin, cos) of angles in grad rounded to the nearest sensor step """
+        index = numpy.rint(numpy.asarray(grad) / ANGLE_STEP).astype(numpy.int64) + 32768
+        numpy.clip(index, 0, len(self.sin) - 1, out=index)
+        return self.sin[index], self.cos[index]
+
+
+@functools.lru_cache(maxsize=None)
+def trig_table():
+    return TrigTable()
+
+
+def to_horizont_array(y, x, z, roll_grad, pitch_grad, quantized=False):
+    """ Vectorized to_horizont for arrays of samples
+
+        quantized: take sin/cos from trig_table() instead of computing them,
+        angles are rounded to the sensor step 359.9/65536 grad
+    """
+    y, x, z = numpy.asarray(y), numpy.asarray(x), numpy.asarray(z)
+    if quantized:
+        sin_r, cos_r = trig_table().lookup(roll_grad)
+        sin_p, cos_p = trig_table().lookup(-numpy.asarray(pitch_grad))
+    else:
+        r = numpy.radians(roll_grad)
+        p = numpy.radians(-numpy.asarray(pitch_grad))
+        sin_r, cos_r, sin_p, cos_p = numpy.sin(r), numpy.cos(r), numpy.sin(p), numpy.cos(p)
+
+    xh = x * cos_p - y * sin_p * sin_r + z * sin_p * cos_r
+    yh = y * cos_r + z * sin_r
+    zh = x * sin_p + y * sin_r * cos_p - z * cos_p * cos_r
+
+    return yh, xh, zh
+
+
+def soft_iron_coefficients(phi, k):
+    """ Coefficients A, B, C, D squeezing fields by k along the axis rotated by phi (radians) """
+    A = k * pow(math.cos(phi), 2) + pow(math.sin(phi), 2)
+    B = (k * math.sin(2 * phi) - math.sin(2 * phi)) * 0.5
+    C = (math.sin(2 * phi) - k * math.sin(2 * phi)) * 0.5
+    D = k * pow(math.sin(phi), 2) + pow(math.cos(phi), 2)
+    return A, B, C, D
+
+
+def heading(x, y):
+    """ Heading in grad [0, 360) of corrected fields, x, y are numbers or arrays """
+    h = numpy.degrees(numpy.arctan2(-numpy.asarray(y), x))
+    return numpy.where(h < 0, 360 + h, h)
+
+
+def reject_outliers(fields, threshold=3.5):
+    """ Drop samples whose field magnitude is far from the others
+
+    The magnitude is taken around the median of every column and compared
+    with its median by the median absolute deviation (MAD), samples with
+    |r - median| > threshold * 1.4826 * MAD are rejected. The spread of a
+    calibration ellipse is well within it, corrupted frames are not.
+    Returns (inliers, number of rejected samples).
+    """
+    fields = numpy.asarray(fields, dtype=float)
+    if len(fields) < 3:
+        return fields, 0
+    radius = numpy.sqrt(((fields - numpy.median(fields, axis=0)) ** 2).sum(axis=1))
+    median = numpy.median(radius)
+    mad = 1.4826 * numpy.median(numpy.abs(radius - median))
+    inliers = numpy.abs(radius - median) <= threshold * mad if mad > 0 else radius == median
+    return fields[inliers], int(len(fields) - inliers.sum())
+
+
+class Correction(object):
+    """ Hard iron offset and soft iron coefficients A, B, C, D applied to fields B (x), C (y) """
+    # Attributes saved by coefficients(), phi_degree and k are optional
+    COEFFICIENTS = ('x_offset', 'y_offset', 'A', 'B', 'C', 'D', 'clockwise', 'phi_degree', 'k')
+
+    def coefficients(self):
+        """ Return dict of the coefficients (JSON serializable) """
+        return {name: getattr(self, name) for name in self.COEFFICIENTS if hasattr(self, name)}
+
+    @classmethod
+    def restore(cls, coefficients):
+        """ Create the calibration from coefficients() without fitting """
+        obj = cls.__new__(cls)
+        for name in cls.COEFFICIENTS:
+            if name in coefficients:
+                setattr(obj, name, coefficients[name])
+        return obj
+
+    def correct(self, x, y):
         """
         Функция возвращающая скорректирования магнитных полей B,C
         после калибрвоки
@@ -41,6 +134,35 @@ class FixTable(object):
         x0, y0 = self._compensate_hard_iron(x, y)
         return self._compensate_soft_iron(x0, y0)
 
+    def correct_heading(self, x0, y0):
+        x, y = self.correct(x0, y0)
+        h = math.degrees(math.atan2(-y, x))
+        if h < 0:
+            return 360 + h
+        else:
+            return h
+
+    @property
+    def offset(self):
+        return numpy.array((self.x_offset, self.y_offset))
+
+    @property
+    def matrix(self):
+        """ 2x2 soft iron matrix, corrected [x, y] = matrix @ ([x, y] - offset) """
+        if self.clockwise:
+            return numpy.array(((self.A, self.B), (-self.C, self.D)))
+        else:
+            return numpy.array(((self.A, -self.B), (self.C, self.D)))
+
+    def correct_array(self, xy):
+        """ Correct (N, 2) array of [x, y] fields, return (N, 2) array """
+        return (numpy.asarray(xy, dtype=float)[:, :2] - self.offset) @ self.matrix.T
+
+    def correct_heading_array(self, xy):
+        """ Return (N,) array of corrected headings of (N, 2) array of [x, y] fields """
+        corrected = self.correct_array(xy)
+        return heading(corrected[:, 0], corrected[:, 1])
+
     def _compensate_soft_iron(self, x0, y0):
         if self.clockwise:
             return (x0 * self.A + y0 * self.B), (-x0 * self.C + y0 * self.D)
@@ -53,23 +175,51 @@ class FixTable(object):
         return x0, y0
 
 
-class Algorithm:
-    """ This class used to correct raw magnetic field B,C"""
+class FixTable(Correction):
+    """ Fixed calibration coefficients, offset and matrix are computed once """
+    # Engine which fitted the coefficients, known when made by from_correction()
+    engine = None
 
-    def __init__(self, fields):
-        # FIXME: Необходимо принимать непустой список
-        self.ds = fields.copy()
-        self._compute()
+    def __init__(self, xoffset, yoffset, a, b , c , d, clockwise):
+        self.x_offset = xoffset
+        self.y_offset = yoffset
+        self.A = a
+        self.B = b
+        self.C = c
+        self.D = d
+        self.clockwise = clockwise
+        self._prepare()
 
     def __repr__(self):
-        return "<class Algorithm> x_offset={0:.2f}, y_offset={1:.2f}, phi={2:.2f}, clockwise={3}, k={4:.2f}".format(
-            self.x_offset,
-            self.y_offset,
-            self.phi_degree,
-            self.clockwise,
-            self.k)
+        return "<class FixTable> x_offset={0:.2f}, y_offset={1:.2f}, A={2:.3f}, B={3:.3f}, C={4:.3f}, D={5:.3f}".format(
+            self.x_offset, self.y_offset, self.A, self.B, self.C, self.D)
 
-    def correct(self, x, y):
+    @classmethod
+    def restore(cls, coefficients):
+        obj = super().restore(coefficients)
+        obj._prepare()
+        return obj
+
+    @classmethod
+    def from_correction(cls, correction):
+        """ Fix the coefficients of a fitted calibration (Algorithm, EllipseAlgorithm) """
+        obj = cls.restore(correction.coefficients())
+        obj.engine = correction.engine
+        return obj
+
+    def _prepare(self):
+        self._offset = Correction.offset.fget(self)
+        self._matrix = Correction.matrix.fget(self)
+
+    @property
+    def offset(self):
+        return self._offset
+
+    @property
+    def matrix(self):
+        return self._matrix
+
+    def compensate(self, x, y):
         """
         Функция возвращающая скорректирования магнитных полей B,C
         после калибрвоки
@@ -80,36 +230,49 @@ class Algorithm:
         x0, y0 = self._compensate_hard_iron(x, y)
         return self._compensate_soft_iron(x0, y0)
 
-    def correct_heading(self, x0, y0):
-        x, y = self.correct(x0, y0)
-        h = math.degrees(math.atan2(-y, x))
-        if h < 0:
-            return 360 + h
-        else:
-            return h
+    def compensate_array(self, xy):
+        return self.correct_array(xy)
+
+
+class Algorithm(Correction):
+    """ This class used to correct raw magnetic field B,C"""
+    engine = 'maxmin'
+
+    def __init__(self, fields):
+        # FIXME: Необходимо принимать непустой список
+        self.ds = numpy.array(fields, dtype=float)
+        self._compute()
+
+    def __repr__(self):
+        return "<class Algorithm> x_offset={0:.2f}, y_offset={1:.2f}, phi={2:.2f}, clockwise={3}, k={4:.2f}".format(
+            self.x_offset,
+            self.y_offset,
+            self.phi_degree,
+            self.clockwise,
+            self.k)
 
     def _compute(self):
         """ Calculate calibration coefficients (Xoffset, Yoffset, А, B, C, D)"""
         self._compute_hard_iron()
-        ds_hard_iron = [(x - self.x_offset, y - self.y_offset) for (x, y) in self.ds]
+        ds_hard_iron = self.ds[:, :2] - (self.x_offset, self.y_offset)
         self._compute_soft_iron(ds_hard_iron)
 
     def _compute_hard_iron(self):
-        x_max = max(self.ds)[0]
-        x_min = min(self.ds)[0]
-        y_max = max(self.ds, key=itemgetter(1))[1]
-        y_min = min(self.ds, key=itemgetter(1))[1]
+        x, y = self.ds[:, 0], self.ds[:, 1]
+        x_max = x.max()
+        x_min = x.min()
+        y_max = y.max()
+        y_min = y.min()
 
         # <2> Calculate hard iron offset <\>
-        self.x_offset = (x_max + x_min) * 0.5
-        self.y_offset = (y_max + y_min) * 0.5
+        self.x_offset = float((x_max + x_min) * 0.5)
+        self.y_offset = float((y_max + y_min) * 0.5)
 
     def _compute_soft_iron(self, ds_hard_iron):
+        x, y = ds_hard_iron[:, 0], ds_hard_iron[:, 1]
+
         # <4> Calculate full magnetic vector H for each pair X, Y and find max H <\>
-        h_max = max(
-            ds_hard_iron,
-            key=lambda item: math.sqrt(item[0] * item[0] + item[1] * item[1])
-        )
+        h_max = ds_hard_iron[numpy.argmax(numpy.sqrt(x * x + y * y))].tolist()
 
         # <5> Caclulate rotate side and angle phi <\>
         #FIXME: Обработать ситуацию если (h_max[1] * h_max[0]) == 0
@@ -117,42 +280,266 @@ class Algorithm:
             phi = math.atan(h_max[1] / h_max[0])
             self.clockwise = clockwise = True
         else:
-            print(h_max[1], h_max[0])
+            logger.debug("counterclockwise rotation, h_max = (%s, %s)", h_max[0], h_max[1])
             phi = -math.atan(h_max[1] / h_max[0])
             self.clockwise = clockwise = False
         self.phi_degree = phi * (180.0 / math.pi)
 
         # <6> Rotate each pair X, Y on theta angle <\>
-        def rotate(x, y, angle, clockwise):
-            if clockwise:
-                x_rot = x * math.cos(angle) + y * math.sin(angle)
-                y_rot = - x * math.sin(angle) + y * math.cos(angle)
-            else:
-                x_rot = x * math.cos(angle) - y * math.sin(angle)
-                y_rot = x * math.sin(angle) + y * math.cos(angle)
-            return x_rot, y_rot
-
-        ds_rotate = [rotate(x, y, phi, clockwise) for (x, y) in ds_hard_iron]
+        cos_phi, sin_phi = math.cos(phi), math.sin(phi)
+        if clockwise:
+            x_rot = x * cos_phi + y * sin_phi
+            y_rot = - x * sin_phi + y * cos_phi
+        else:
+            x_rot = x * cos_phi - y * sin_phi
+            y_rot = x * sin_phi + y * cos_phi
 
         # <7> Caclulate a, b, k  magnetic ellipsoid <\>
-        ds_rotate_module = [(abs(x), abs(y)) for (x, y) in ds_rotate]
-        a = max(ds_rotate_module, key=itemgetter(0))[0]
-        b = max(ds_rotate_module, key=itemgetter(1))[1]
+        a = float(numpy.abs(x_rot).max())
+        b = float(numpy.abs(y_rot).max())
         self.k = k = b / a
 
         # <8> Calculate correction coefficient A,B,C,D
-        self.A = k * pow(math.cos(phi), 2) + pow(math.sin(phi), 2)
-        self.B = (k * math.sin(2 * phi) - math.sin(2 * phi)) * 0.5
-        self.C = (math.sin(2 * phi) - k * math.sin(2 * phi)) * 0.5
-        self.D = k * pow(math.sin(phi), 2) + pow(math.cos(phi), 2)
+        self.A, self.B, self.C, self.D = soft_iron_coefficients(phi, k)
 
-    def _compensate_soft_iron(self, x0, y0):
-        if self.clockwise:
-            return (x0 * self.A + y0 * self.B), (-x0 * self.C + y0 * self.D)
+
+class EllipseAlgorithm(Correction):
+    """ Calibration by direct least squares fit of an ellipse to fields B,C
+
+    The conic a*x^2 + b*x*y + c*y^2 + d*x + e*y + f = 0 with 4ac - b^2 = 1
+    is fitted to all samples (Halir & Flusser), so single outliers or
+    missing sectors shift it much less than the extreme points used by
+    Algorithm. The result has the same attributes as Algorithm.
+    """
+    engine = 'ellipse'
+
+    def __init__(self, fields):
+        self.ds = numpy.array(fields, dtype=float)
+        self._compute()
+
+    def __repr__(self):
+        return "<class EllipseAlgorithm> x_offset={0:.2f}, y_offset={1:.2f}, phi={2:.2f}, k={3:.2f}".format(
+            self.x_offset,
+            self.y_offset,
+            self.phi_degree,
+            self.k)
+
+    def _compute(self):
+        xy = self.ds[:, :2]
+        if len(xy) < 5:
+            raise ValueError("ellipse fit needs at least 5 samples")
+
+        # Fit in centred and scaled coordinates for a well conditioned system
+        mean = xy.mean(axis=0)
+        scale = xy.std() or 1.0
+        x, y = ((xy - mean) / scale).T
+
+        d1 = numpy.column_stack((x * x, x * y, y * y))
+        d2 = numpy.column_stack((x, y, numpy.ones_like(x)))
+        s1, s2, s3 = d1.T @ d1, d1.T @ d2, d2.T @ d2
+        t = -numpy.linalg.solve(s3, s2.T)
+        m = s1 + s2 @ t
+        m = numpy.array((m[2] / 2, -m[1], m[0] / 2))
+        _, vectors = numpy.linalg.eig(m)
+        vectors = vectors.real
+        condition = 4 * vectors[0] * vectors[2] - vectors[1] ** 2
+        if not (condition > 0).any():
+            raise ValueError("samples do not lie on an ellipse")
+        a1 = vectors[:, condition > 0][:, 0]
+        a, b, c, d, e, f = numpy.concatenate((a1, t @ a1))
+
+        # Centre, axes and their direction
+        center = numpy.linalg.solve(((2 * a, b), (b, 2 * c)), (-d, -e))
+        f0 = f + (d * center[0] + e * center[1]) / 2
+        values, axes = numpy.linalg.eigh(((a, b / 2), (b / 2, c)))
+        semi = numpy.sqrt(-f0 / values)
+        if not numpy.isfinite(semi).all():
+            raise ValueError("samples do not lie on an ellipse")
+
+        self.x_offset, self.y_offset = (mean + scale * center).tolist()
+        # eigh sorts eigenvalues ascending: the first axis is the major one
+        major = axes[:, 0]
+        phi = math.atan(major[1] / major[0]) if major[0] else math.pi / 2
+        self.phi_degree = math.degrees(phi)
+        self.clockwise = True
+        self.k = k = float(semi[1] / semi[0])
+        self.A, self.B, self.C, self.D = soft_iron_coefficients(phi, k)
+
+
+class OnlineAlgorithm(object):
+    """ Streaming estimator of Algorithm coefficients with bounded memory
+
+    Keeps running min/max of x and y (the points giving them) and, for each
+    of bins angular sectors around the current hard iron centre, the point
+    farthest from the centre. update() is O(1), fit() runs Algorithm on
+    these at most bins + 4 points, so coefficients are available at any
+    moment of the collection.
+    """
+
+    def __init__(self, bins=360):
+        self.bins = bins
+        self.count = 0
+        self.points = [None] * bins
+        # Points with x max, x min, y max, y min
+        self.extremes = [None] * 4
+        self._fit = None
+
+    @property
+    def center(self):
+        x_max, x_min, y_max, y_min = self.extremes
+        return (x_max[0] + x_min[0]) * 0.5, (y_max[1] + y_min[1]) * 0.5
+
+    def update(self, x, y):
+        self.count += 1
+        self._fit = None
+
+        x_max, x_min, y_max, y_min = self.extremes
+        if x_max is None:
+            self.extremes = [(x, y)] * 4
         else:
-            return (x0 * self.A - y0 * self.B), (x0 * self.C + y0 * self.D)
+            if x > x_max[0]:
+                self.extremes[0] = (x, y)
+            if x < x_min[0]:
+                self.extremes[1] = (x, y)
+            if y > y_max[1]:
+                self.extremes[2] = (x, y)
+            if y < y_min[1]:
+                self.extremes[3] = (x, y)
 
-    def _compensate_hard_iron(self, x, y):
-        x0 = x - self.x_offset
-        y0 = y - self.y_offset
-        return x0, y0
+        cx, cy = self.center
+        dx, dy = x - cx, y - cy
+        i = int(math.degrees(math.atan2(dy, dx)) % 360.0 * self.bins / 360.0) % self.bins
+        point = self.points[i]
+        if point is None or dx * dx + dy * dy > (point[0] - cx) ** 2 + (point[1] - cy) ** 2:
+            self.points[i] = (x, y)
+
+    def update_array(self, xy):
+        """ Update by (N, 2) array of [x, y] samples """
+        xy = numpy.asarray(xy, dtype=float)[:, :2]
+        if not len(xy):
+            return
+        self.count += len(xy)
+        self._fit = None
+
+        candidates = [tuple(xy[i]) for i in (xy[:, 0].argmax(), xy[:, 0].argmin(), xy[:, 1].argmax(), xy[:, 1].argmin())]
+        for k, (candidate, current) in enumerate(zip(candidates, self.extremes)):
+            axis, sign = k // 2, (1, -1)[k % 2]
+            if current is None or sign * candidate[axis] > sign * current[axis]:
+                self.extremes[k] = candidate
+
+        cx, cy = self.center
+        stored = [p for p in self.points if p is not None]
+        points = numpy.concatenate((numpy.array(stored).reshape(-1, 2), xy))
+        dx, dy = points[:, 0] - cx, points[:, 1] - cy
+        index = (numpy.degrees(numpy.arctan2(dy, dx)) % 360.0 * self.bins / 360.0).astype(int) % self.bins
+        order = numpy.lexsort((dx * dx + dy * dy, index))
+        index = index[order]
+        last = numpy.append(index[1:] != index[:-1], True)
+        self.points = [None] * self.bins
+        for i, point in zip(index[last].tolist(), points[order][last].tolist()):
+            self.points[i] = tuple(point)
+
+    @property
+    def dataset(self):
+        """ (M, 2) array of the retained points """
+        points = [p for p in self.extremes + self.points if p is not None]
+        return numpy.array(points, dtype=float).reshape(-1, 2)
+
+    @property
+    def coverage(self):
+        """ Number of angular sectors with a point """
+        return sum(p is not None for p in self.points)
+
+    def fit(self):
+        """ Return Algorithm fitted on the retained points, None while it can not be fitted """
+        if self._fit is None and self.count >= 3:
+            try:
+                self._fit = Algorithm(self.dataset)
+            except (ZeroDivisionError, ValueError):
+                self._fit = None
+        return self._fit
+
+
+
+class EllipsoidAlgorithm(object):
+    """ 3-D hard and soft iron calibration of fields B, C, Z
+
+    The quadric a*x^2 + b*y^2 + c*z^2 + 2d*xy + 2e*xz + 2f*yz + 2g*x + 2h*y + 2i*z = 1
+    is fitted to (N, 3) samples [x, y, z] by least squares. Corrected fields
+    matrix @ ([x, y, z] - offset) lie on a sphere with the radius of the
+    geometric mean of the ellipsoid semi-axes, so they can be tilt
+    compensated at any heel instead of calibrating every heel in 2-D.
+    """
+
+    engine = 'ellipsoid'
+
+    def __init__(self, fields):
+        self.ds = numpy.array(fields, dtype=float)
+        self._compute()
+
+    def coefficients(self):
+        """ Return dict of offset, radius and matrix (JSON serializable) """
+        return {'offset': self.offset.tolist(), 'radius': self.radius, 'matrix': self.matrix.tolist()}
+
+    @classmethod
+    def restore(cls, coefficients):
+        """ Create the calibration from coefficients() without fitting """
+        obj = cls.__new__(cls)
+        obj.offset = numpy.array(coefficients['offset'], dtype=float)
+        obj.radius = float(coefficients['radius'])
+        obj.matrix = numpy.array(coefficients['matrix'], dtype=float)
+        return obj
+
+    def __repr__(self):
+        return "<class EllipsoidAlgorithm> offset=({0:.2f}, {1:.2f}, {2:.2f}), radius={3:.2f}".format(
+            *self.offset, self.radius)
+
+    def _compute(self):
+        xyz = self.ds[:, :3]
+        if len(xyz) < 9:
+            raise ValueError("ellipsoid fit needs at least 9 samples")
+
+        mean = xyz.mean(axis=0)
+        scale = xyz.std() or 1.0
+        x, y, z = ((xyz - mean) / scale).T
+        design = numpy.column_stack((x * x, y * y, z * z, 2 * x * y, 2 * x * z, 2 * y * z, 2 * x, 2 * y, 2 * z))
+        (a, b, c, d, e, f, g, h, i), *_ = numpy.linalg.lstsq(design, numpy.ones_like(x), rcond=None)
+
+        quadric = numpy.array(((a, d, e), (d, b, f), (e, f, c)))
+        center = -numpy.linalg.solve(quadric, (g, h, i))
+        quadric = quadric / (1.0 + center @ quadric @ center)
+        values, vectors = numpy.linalg.eigh(quadric)
+        if not (values > 0).all():
+            raise ValueError("samples do not lie on an ellipsoid")
+
+        # Semi-axes are 1/sqrt(values), map them to a sphere of their geometric mean
+        radius = numpy.prod(values) ** (-1.0 / 6.0)
+        self.offset = mean + scale * center
+        self.radius = float(radius * scale)
+        self.matrix = vectors @ numpy.diag(numpy.sqrt(values) * radius) @ vectors.T
+
+    def correct_array(self, xyz):
+        """ Correct (N, 3) array of [x, y, z] fields, return (N, 3) array """
+        return (numpy.asarray(xyz, dtype=float)[:, :3] - self.offset) @ self.matrix.T
+
+    def to_horizont(self, y, x, z, roll_grad, pitch_grad, quantized=False):
+        """ Correct fields and compensate tilt, arguments and result as to_horizont_array """
+        corrected = self.correct_array(numpy.column_stack((x, y, z)))
+        return to_horizont_array(corrected[:, 1], corrected[:, 0], corrected[:, 2], roll_grad, pitch_grad, quantized)
+
+    def heading_array(self, y, x, z, roll_grad, pitch_grad, quantized=False):
+        """ Return (N,) array of headings after 3-D correction and tilt compensation """
+        yh, xh, _ = self.to_horizont(y, x, z, roll_grad, pitch_grad, quantized)
+        return heading(xh, yh)
+
+# Calibration engines: classes fitted by Engine(fields) from (N, 2) samples,
+# with x_offset, y_offset, A, B, C, D, clockwise, phi_degree and k
+ENGINES = {
+    Algorithm.engine: Algorithm,
+    EllipseAlgorithm.engine: EllipseAlgorithm,
+}
+
+
+def fit(fields, engine=Algorithm.engine):
+    """ Fit calibration by the engine with the given name """
+    return ENGINES[engine](fields)
@@ -0,0 +1,439 @@
+""" Benchmarks of the sensor data pipeline
+
+    Usage: python benchmark.py [name ...]
+    Without arguments all benchmarks are run.
+"""
+import argparse
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from operator import itemgetter
+
+import numpy
+
+import algorithms
+import sensor
+import simulator
+
+
+def best_time(func, *args, repeat=3):
+    """ Return the best wall time of several runs of func(*args) """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def make_frame(pid, payload, trailer=b'\x00'):
+    return sensor.FrameDecoder.SYNC + bytes((pid, len(payload))) + payload + trailer
+
+
+def random_bytes(size, rnd=random):
+    return bytes(rnd.getrandbits(8) for _ in range(size))
+
+
+# Decoder
+def legacy_frames(stream):
+    """ Reference byte-at-a-time state machine (Sensor.run before FrameDecoder) """
+    frames = []
+    message = b''
+    start = 0
+    pid = 0
+    size = 0
+    for i in range(len(stream)):
+        buf = stream[i:i + 1]
+        if start == 0:
+            start = 1 if buf == sensor.Sensor.SOP1 else 0
+        elif start == 1:
+            start = 2 if buf == sensor.Sensor.SOP2 else 0
+        elif start == 2:
+            start = 3 if buf == sensor.Sensor.SOP3 else 0
+        elif start == 3:
+            pid = int.from_bytes(buf, byteorder='little')
+            start = 4
+        elif start == 4:
+            size = int.from_bytes(buf, byteorder='little')
+            start = 5
+        elif start == 5:
+            if len(message) < size:
+                message += buf
+            else:
+                frames.append((pid, message))
+                start = 0
+                message = b''
+    return frames
+
+
+def block_frames(stream, chunk=4096):
+    decoder = sensor.FrameDecoder()
+    frames = []
+    for i in range(0, len(stream), chunk):
+        frames.extend((pid, bytes(payload)) for pid, payload in decoder.feed(stream[i:i + chunk]))
+    return frames
+
+
+def block_dorient(stream, chunk=4096):
+    decoder = sensor.FrameDecoder()
+    result = []
+    for i in range(0, len(stream), chunk):
+        for pid, payload in decoder.feed(stream[i:i + chunk]):
+            if pid == sensor.Sensor.PID_DORIENT:
+                result.append(sensor.parse_dorient(payload))
+    return result
+
+
+def legacy_dorient(stream):
+    return [sensor.parse_dorient(message) for pid, message in legacy_frames(stream)
+            if pid == sensor.Sensor.PID_DORIENT]
+
+
+def bench_decoder(frames=20000):
+    rnd = random.Random(0)
+
+    # Equivalence on every pid/size combination, fed in uneven chunks
+    for size in range(256):
+        stream = b''.join(make_frame(pid, random_bytes(size, rnd), random_bytes(1, rnd)) for pid in range(256))
+        expected = legacy_frames(stream)
+        for chunk in (7, 4096):
+            assert block_frames(stream, chunk) == expected, (size, chunk)
+    print("decoder: output identical to legacy parser for all pid/size combinations")
+
+    stream = b''.join(
+        make_frame(sensor.Sensor.PID_DORIENT, random_bytes(18, rnd), random_bytes(1, rnd))
+        for _ in range(frames))
+    assert block_dorient(stream) == legacy_dorient(stream)
+
+    for name, func in (("legacy", legacy_dorient), ("block", block_dorient)):
+        elapsed = best_time(func, stream)
+        print("decoder: {0:>8}: {1:12.0f} bytes/s {2:10.0f} frames/s".format(
+            name, len(stream) / elapsed, frames / elapsed))
+
+
+# DORIENT payload decoding
+def legacy_parse_dorient(message):
+    """ Reference per-field decoding (parse_dorient before struct/numpy decoding) """
+    fields = [message[2 * i: 2 * (i + 1)] for i in range(9)]
+    return tuple(
+        sensor.kang2dec(field, signed=(i != 2)) if i < 3 else sensor.gauss2tesla(field)
+        for i, field in enumerate(fields))
+
+
+def bench_dorient(frames=100000):
+    rnd = random.Random(0)
+
+    # Every 16-bit value in every field
+    values = numpy.arange(65536, dtype='<u2')
+    payloads = numpy.repeat(values, sensor.DORIENT_FIELDS).tobytes()
+    size = sensor.DORIENT.size
+    expected = [legacy_parse_dorient(payloads[i:i + size]) for i in range(0, len(payloads), size)]
+    assert [sensor.parse_dorient(payloads[i:i + size]) for i in range(0, len(payloads), size)] == expected
+    assert sensor.decode_dorient(payloads).tolist() == [list(row) for row in expected]
+    print("dorient: batch and per-frame decoding identical to legacy for all field values")
+
+    payloads = random_bytes(frames * size, rnd)
+    messages = [payloads[i:i + size] for i in range(0, len(payloads), size)]
+    for name, func in (
+            ("legacy", lambda: [legacy_parse_dorient(m) for m in messages]),
+            ("struct", lambda: [sensor.parse_dorient(m) for m in messages]),
+            ("batch", lambda: sensor.decode_dorient(payloads))):
+        elapsed = best_time(func)
+        print("dorient: {0:>8}: {1:12.0f} frames/s".format(name, frames / elapsed))
+
+
+# Calibration fit
+DATASETS = [os.path.join(os.path.dirname(__file__), '..', 'doc', 'dataset_{}.csv'.format(i)) for i in (1, 2, 3)]
+
+
+def load_dataset(path):
+    """ Return (N, 2) array of the first two columns of a dataset """
+    return numpy.loadtxt(path, delimiter=',', ndmin=2)[:, :2]
+
+
+class LegacyAlgorithm(object):
+    """ Reference pure Python fit (Algorithm before vectorization) """
+
+    def __init__(self, fields):
+        ds = [tuple(row) for row in fields]
+        x_max = max(ds)[0]
+        x_min = min(ds)[0]
+        y_max = max(ds, key=itemgetter(1))[1]
+        y_min = min(ds, key=itemgetter(1))[1]
+        self.x_offset = (x_max + x_min) * 0.5
+        self.y_offset = (y_max + y_min) * 0.5
+
+        ds_hard_iron = [(x - self.x_offset, y - self.y_offset) for (x, y) in ds]
+        h_max = max(ds_hard_iron, key=lambda item: math.sqrt(item[0] * item[0] + item[1] * item[1]))
+        if (h_max[1] * h_max[0]) > 0:
+            phi = math.atan(h_max[1] / h_max[0])
+            self.clockwise = clockwise = True
+        else:
+            phi = -math.atan(h_max[1] / h_max[0])
+            self.clockwise = clockwise = False
+        self.phi_degree = phi * (180.0 / math.pi)
+
+        def rotate(x, y, angle, clockwise):
+            if clockwise:
+                return x * math.cos(angle) + y * math.sin(angle), - x * math.sin(angle) + y * math.cos(angle)
+            return x * math.cos(angle) - y * math.sin(angle), x * math.sin(angle) + y * math.cos(angle)
+
+        ds_rotate_module = [(abs(x), abs(y)) for (x, y) in (rotate(x, y, phi, clockwise) for (x, y) in ds_hard_iron)]
+        a = max(ds_rotate_module, key=itemgetter(0))[0]
+        b = max(ds_rotate_module, key=itemgetter(1))[1]
+        self.k = k = b / a
+        self.A = k * pow(math.cos(phi), 2) + pow(math.sin(phi), 2)
+        self.B = (k * math.sin(2 * phi) - math.sin(2 * phi)) * 0.5
+        self.C = (math.sin(2 * phi) - k * math.sin(2 * phi)) * 0.5
+        self.D = k * pow(math.sin(phi), 2) + pow(math.cos(phi), 2)
+
+
+COEFFICIENTS = ('x_offset', 'y_offset', 'phi_degree', 'clockwise', 'k', 'A', 'B', 'C', 'D')
+
+
+def coefficients(fit):
+    return tuple(getattr(fit, name) for name in COEFFICIENTS)
+
+
+def simulated_dataset(n, seed=0):
+    """ (N, 2) [y, x] samples of a full turn from the simulator """
+    source = simulator.Simulator(rate=n / 360.0, rotation=1.0, noise=0.1, seed=seed)
+    values = source.values(numpy.arange(n) / source.rate)
+    return values[:, [6, 7]]
+
+
+def bench_fit(sizes=(1000, 10000, 100000, 1000000, 10000000), legacy_limit=1000000):
+    for path in DATASETS:
+        ds = load_dataset(path).tolist()
+        assert coefficients(algorithms.Algorithm(ds)) == coefficients(LegacyAlgorithm(ds)), path
+    print("fit: coefficients identical to legacy on {}".format(', '.join(os.path.basename(p) for p in DATASETS)))
+
+    for n in sizes:
+        ds = simulated_dataset(n)
+        line = "fit: {0:>9} samples: numpy {1:8.4f} s".format(n, best_time(algorithms.Algorithm, ds, repeat=1))
+        if n <= legacy_limit:
+            rows = ds.tolist()
+            assert coefficients(algorithms.Algorithm(ds)) == coefficients(LegacyAlgorithm(rows))
+            line += ", legacy {0:8.4f} s".format(best_time(LegacyAlgorithm, rows, repeat=1))
+        print(line)
+
+
+def bench_correct(n=1000000):
+    ds = simulated_dataset(n)
+    fit = algorithms.Algorithm(ds)
+    rows = ds.tolist()
+    for name, func in (
+            ("scalar", lambda: [fit.correct_heading(x, y) for x, y in rows]),
+            ("batch", lambda: fit.correct_heading_array(ds))):
+        elapsed = best_time(func, repeat=1)
+        print("correct: {0:>8}: {1:12.0f} samples/s".format(name, n / elapsed))
+
+
+def bench_tilt(n=1000000):
+    source = simulator.Simulator(roll=20.0, pitch=10.0, noise=0.1, seed=0)
+    # Angles as decoded from the sensor, on its 359.9/65536 grid
+    values = sensor.decode_dorient(sensor.encode_dorient(source.values(numpy.arange(n) / source.rate)))
+    r, p, y, x, z = (values[:, i] for i in (0, 1, 6, 7, 8))
+    expected = numpy.array([algorithms.to_horizont(*args) for args in zip(y[:10000], x[:10000], z[:10000], r[:10000], p[:10000])])
+    for quantized in (False, True):
+        result = numpy.array(algorithms.to_horizont_array(y[:10000], x[:10000], z[:10000], r[:10000], p[:10000], quantized))
+        print("tilt: quantized={0}: max difference from scalar {1:.2e}".format(quantized, abs(result.T - expected).max()))
+
+    algorithms.trig_table()
+    rows = list(zip(y.tolist(), x.tolist(), z.tolist(), r.tolist(), p.tolist()))
+    for name, func in (
+            ("scalar", lambda: [algorithms.to_horizont(*args) for args in rows]),
+            ("batch", lambda: algorithms.to_horizont_array(y, x, z, r, p)),
+            ("table", lambda: algorithms.to_horizont_array(y, x, z, r, p, quantized=True))):
+        elapsed = best_time(func, repeat=1)
+        print("tilt: {0:>8}: {1:12.0f} samples/s".format(name, n / elapsed))
+
+
+def bench_online(n=1000000):
+    ds = simulated_dataset(n)
+    rows = ds.tolist()
+
+    def scalar():
+        online = algorithms.OnlineAlgorithm()
+        for x, y in rows:
+            online.update(x, y)
+        return online
+
+    online = scalar()
+    full, estimate = coefficients(algorithms.Algorithm(ds)), coefficients(online.fit())
+    print("online: {0} retained points, difference from full fit: {1}".format(len(online.dataset), ", ".join(
+        "{0}={1:.2e}".format(name, abs(a - b)) for name, a, b in zip(COEFFICIENTS, full, estimate))))
+
+    elapsed = best_time(scalar, repeat=1)
+    print("online: update: {0:12.0f} samples/s".format(n / elapsed))
+    elapsed = best_time(lambda: algorithms.OnlineAlgorithm().update_array(ds), repeat=1)
+    print("online: update_array: {0:12.0f} samples/s".format(n / elapsed))
+    elapsed = best_time(lambda: algorithms.Algorithm(online.dataset))
+    print("online: fit: {0:.6f} s".format(elapsed))
+
+
+def simulated_turn(n, noise=0.1, seed=0):
+    """ ([x, y] samples, true heading) of one turn of the simulator with n samples """
+    source = simulator.Simulator(rate=n / 360.0, rotation=1.0, noise=noise, seed=seed)
+    t = numpy.arange(n) / source.rate
+    values = source.values(t)
+    return values[:, [7, 6]], t % 360.0
+
+
+def heading_error(fit, xy, true_heading):
+    return (fit.correct_heading_array(xy) - true_heading + 180.0) % 360.0 - 180.0
+
+
+def radius_residual(fit, xy):
+    """ Relative standard deviation of the corrected field magnitude """
+    corrected = fit.correct_array(xy)
+    radius = numpy.hypot(corrected[:, 0], corrected[:, 1])
+    return radius.std() / radius.mean()
+
+
+def bench_engines(sizes=(12, 36, 360, 100000)):
+    for path in DATASETS:
+        ds = load_dataset(path)
+        print("engines: {0}: ".format(os.path.basename(path)) + ", ".join(
+            "{0} radius residual {1:.4f}".format(name, radius_residual(engine(ds), ds))
+            for name, engine in algorithms.ENGINES.items()))
+
+    for n in sizes:
+        xy, true_heading = simulated_turn(n)
+        check_xy, check_heading = simulated_turn(3600, noise=0.0, seed=1)
+        for name, engine in algorithms.ENGINES.items():
+            elapsed = best_time(engine, xy)
+            error = heading_error(engine(xy), check_xy, check_heading)
+            print("engines: {0:>6} samples: {1:>6}: fit {2:.6f} s, heading error rms {3:.3f} max {4:.3f} grad".format(
+                n, name, elapsed, numpy.sqrt((error ** 2).mean()), abs(error).max()))
+
+
+def bench_ellipsoid(n=36000):
+    soft_iron = [[1.1, 0.05, 0.02], [0.05, 0.9, -0.03], [0.02, -0.03, 1.05]]
+    source = simulator.Simulator(roll=25.0, pitch=15.0, swing_period=7.3, soft_iron=soft_iron,
+                                 offset=(3.0, -2.0, 1.5), noise=0.1, seed=0)
+    t = numpy.arange(n) / source.rate
+    values = source.values(t)
+    r, p, y, x, z = (values[:, i] for i in (0, 1, 6, 7, 8))
+    true_heading = source.schedule(t) % 360.0
+
+    elapsed = best_time(algorithms.EllipsoidAlgorithm, numpy.column_stack((x, y, z)))
+    fit3d = algorithms.EllipsoidAlgorithm(numpy.column_stack((x, y, z)))
+    error3d = (fit3d.heading_array(y, x, z, r, p) - true_heading + 180.0) % 360.0 - 180.0
+
+    # 2-D calibration of tilt compensated fields
+    yh, xh, _ = algorithms.to_horizont_array(y, x, z, r, p)
+    fit2d = algorithms.Algorithm(numpy.column_stack((xh, yh)))
+    error2d = (fit2d.correct_heading_array(numpy.column_stack((xh, yh))) - true_heading + 180.0) % 360.0 - 180.0
+
+    print("ellipsoid: {0} samples, fit {1:.4f} s".format(n, elapsed))
+    for name, error in (("3-D", error3d), ("2-D", error2d)):
+        print("ellipsoid: {0}: heading error rms {1:.3f} max {2:.3f} grad".format(
+            name, numpy.sqrt((error ** 2).mean()), abs(error).max()))
+
+
+def bench_outliers(n=36000, corrupt=2e-4):
+    source = simulator.Simulator(noise=0.1, corrupt=corrupt, seed=0)
+    t = numpy.arange(n) / source.rate
+    values = sensor.DorientDecoder().decode(source.frames(t))
+    xy = values[:, [7, 6]]
+    clean = simulator.Simulator(noise=0.1, seed=0).values(t)[:, [7, 6]]
+    true_heading = source.schedule(t) % 360.0
+
+    sample = xy[:1000]
+    elapsed = best_time(algorithms.reject_outliers, sample)
+    inliers, rejected = algorithms.reject_outliers(xy)
+    print("outliers: {0:.3f} ms per 1000 points, {1} of {2} decoded frames rejected".format(
+        elapsed * 1000.0, rejected, len(xy)))
+    for engine in algorithms.ENGINES:
+        for name, data in (("raw", xy), ("filtered", inliers)):
+            error = heading_error(algorithms.fit(data, engine), clean, true_heading)
+            print("outliers: {0}: {1}: heading error max {2:.3f} grad".format(engine, name, abs(error).max()))
+
+
+# Whole acquisition stack
+def bench_stack(frames=200000, rate=20000.0):
+    source = simulator.Simulator(rate=rate, noise=0.05, seed=0)
+    bus = simulator.SimulatedBus(source.chunks(chunk_frames=200, duration=frames / rate), speed=None)
+    sensor_ = sensor.Sensor(bus, buffer_size=frames)
+    t = threading.Thread(target=sensor_.run)
+    start = time.perf_counter()
+    t.start()
+    while sensor_.buffer.received < frames and t.is_alive():
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    sensor_.terminate()
+    t.join()
+    print("stack: simulator -> Sensor: {0:10.0f} frames/s ({1} frames, {2} errors)".format(
+        sensor_.buffer.received / elapsed, sensor_.buffer.received, sensor_.errors))
+
+
+# Startup
+def import_times(module):
+    """ Return (wall seconds, total us, [(cumulative us, name)] of imports done by module) in a new interpreter """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode:
+        raise ImportError(result.stderr.strip().splitlines()[-1])
+    total, imports = 0, []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented by two spaces per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            total += int(cumulative)
+        elif depth == 1:
+            imports.append((int(cumulative), name.strip()))
+    return elapsed, total, imports
+
+
+def bench_startup(modules=('cli', 'main', 'magnetic_viewer'), top=8):
+    for module in modules:
+        try:
+            elapsed, total, imports = import_times(module)
+        except ImportError as e:
+            print("startup: {0}: {1}".format(module, e))
+            continue
+        print("startup: {0}: {1:.3f} s, imports {2:.3f} s".format(module, elapsed, total / 1e6))
+        for us, name in sorted(imports, reverse=True)[:top]:
+            print("startup: {0}:   {1:8.1f} ms {2}".format(module, us / 1000.0, name))
+
+
+BENCHMARKS = {
+    'decoder': bench_decoder,
+    'dorient': bench_dorient,
+    'fit': bench_fit,
+    'correct': bench_correct,
+    'tilt': bench_tilt,
+    'online': bench_online,
+    'engines': bench_engines,
+    'ellipsoid': bench_ellipsoid,
+    'outliers': bench_outliers,
+    'stack': bench_stack,
+    'startup': bench_startup,
+}
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('names', nargs='*', metavar='name', help=', '.join(BENCHMARKS))
+    args = p.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        p.error("unknown benchmark: {}".format(', '.join(sorted(unknown))))
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main()
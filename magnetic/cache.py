@@ -0,0 +1,99 @@
+""" On-disk cache of calibration results
+
+    Results are keyed by a hash of the fitted samples, the engine name and
+    VERSION, and kept in a small JSON file per sensor (port or serial):
+
+        {"version": 1, "entries": [{"key": ..., "engine": ..., "coefficients": {...}}, ...]}
+
+    Entries are in order of use, the least recently used ones are dropped
+    above max_entries.
+"""
+import hashlib
+import json
+import os
+import re
+
+import numpy
+
+import algorithms
+
+# Bump when an engine changes its results, old entries are not used then
+VERSION = 1
+CACHE_PATH = os.path.join(os.path.dirname(__file__), 'cache')
+
+CLASSES = dict(algorithms.ENGINES, **{algorithms.EllipsoidAlgorithm.engine: algorithms.EllipsoidAlgorithm})
+
+
+def sensor_filename(path, sensor, ext='.json'):
+    """ File of the sensor (port name or serial) in directory path """
+    name = re.sub(r'[^\w.-]+', '_', str(sensor)).strip('_') or 'default'
+    return os.path.join(path, name + ext)
+
+
+def dataset_key(fields, engine):
+    """ Fingerprint of the samples fitted by the engine """
+    fields = numpy.ascontiguousarray(fields, dtype='<f8')
+    digest = hashlib.sha1()
+    digest.update("{0}:{1}:{2}".format(engine, VERSION, fields.shape).encode())
+    digest.update(fields.tobytes())
+    return digest.hexdigest()
+
+
+class CalibrationCache(object):
+    """ Calibration results of every sensor in a directory, one JSON file per sensor """
+
+    def __init__(self, path=CACHE_PATH, max_entries=32):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def filename(self, sensor):
+        return sensor_filename(self.path, sensor)
+
+    def load(self, sensor):
+        """ Return entries of the sensor, oldest first """
+        try:
+            with open(self.filename(sensor)) as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return []
+        if content.get('version') != VERSION:
+            return []
+        return content.get('entries', [])
+
+    def save(self, sensor, entries):
+        os.makedirs(self.path, exist_ok=True)
+        filename = self.filename(sensor)
+        # Replace the file at once, a reader never sees it half written
+        with open(filename + '.tmp', 'w') as f:
+            json.dump({'version': VERSION, 'entries': entries[-self.max_entries:]}, f)
+        os.replace(filename + '.tmp', filename)
+
+    def get(self, sensor, fields, engine=algorithms.Algorithm.engine):
+        """ Return the cached calibration of fields or None """
+        key = dataset_key(fields, engine)
+        entries = self.load(sensor)
+        for i, entry in enumerate(entries):
+            if entry['key'] == key:
+                if i != len(entries) - 1:
+                    entries.append(entries.pop(i))
+                    self.save(sensor, entries)
+                self.hits += 1
+                return CLASSES[engine].restore(entry['coefficients'])
+        self.misses += 1
+        return None
+
+    def put(self, sensor, fields, engine, result):
+        key = dataset_key(fields, engine)
+        entries = [entry for entry in self.load(sensor) if entry['key'] != key]
+        entries.append({'key': key, 'engine': engine, 'coefficients': result.coefficients()})
+        self.save(sensor, entries)
+
+    def fit(self, sensor, fields, engine=algorithms.Algorithm.engine):
+        """ Return the cached calibration of fields, fit and cache it if there is none """
+        result = self.get(sensor, fields, engine)
+        if result is None:
+            result = CLASSES[engine](fields)
+            self.put(sensor, fields, engine, result)
+        return result
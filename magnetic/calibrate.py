@@ -1,4 +1,9 @@
-from algorithms import Algorithm
+import random
+
+import numpy
+
+import algorithms
+from algorithms import OnlineAlgorithm
 from util import to_csv
 
 
@@ -6,29 +11,116 @@ class Logger(object):
     pass
 
 
+class HeadingIndex(object):
+    """ Samples binned by heading, at most slots samples per bin
+
+    Storage is preallocated (bins x slots x width), when a bin is full a new
+    sample replaces a random one (reservoir sampling), so every bin keeps a
+    uniform subset of its samples however long the heading is held.
+    """
+
+    def __init__(self, bins=360, slots=32, width=3, seed=None):
+        self.bins = bins
+        self.slots = slots
+        self.samples = numpy.empty((bins, slots, width))
+        # Samples seen per bin, the stored ones are min(counts, slots)
+        self.counts = numpy.zeros(bins, dtype=numpy.int64)
+        self._random = random.Random(seed)
+
+    def __len__(self):
+        return int(numpy.minimum(self.counts, self.slots).sum())
+
+    def bin(self, heading):
+        return int(heading % 360.0 * self.bins / 360.0) % self.bins
+
+    def add(self, heading, sample):
+        i = self.bin(heading)
+        n = self.counts[i]
+        slot = n if n < self.slots else self._random.randrange(n + 1)
+        if slot < self.slots:
+            self.samples[i, slot] = sample
+        self.counts[i] = n + 1
+
+    @property
+    def coverage(self):
+        """ Number of bins with samples """
+        return int(numpy.count_nonzero(self.counts))
+
+    def covered(self, sectors):
+        """ True if every of sectors equal sectors has samples (bins must be divisible by sectors) """
+        return bool(self.counts.reshape(sectors, -1).any(axis=1).all())
+
+    def dataset(self):
+        """ (N, width) array of the stored samples """
+        stored = numpy.arange(self.slots) < self.counts[:, None]
+        return self.samples[stored]
+
+
 class Calibrate(object):
+    # Collection is complete when every 10 grad sector has samples
+    SECTORS = 36
+    # 3-D fit needs heel and trim ranges (grad) and the vertical field spread
+    # relative to the horizontal one, a level turn leaves z unconstrained
+    ELLIPSOID_MIN_TILT = 10.0
+    ELLIPSOID_MIN_Z_RATIO = 0.1
 
-    def __init__(self, initial):
+    def __init__(self, initial, engine=algorithms.Algorithm.engine, bins=360, slots=32, cache=None, sensor=None):
         print("Create instance of Calibrate")
-        self.data = []
+        self.engine = engine
+        # cache.CalibrationCache of results of the sensor
+        self.cache = cache
+        self.sensor = sensor
         self.result = []
+        # Number of samples rejected as outliers by compute()
+        self.rejected = 0
+        # Why compute_ellipsoid() returned None
+        self.ellipsoid_error = None
+        self.online = OnlineAlgorithm()
+        # [x, y, z, x_raw, y_raw, z_raw, roll, pitch] by heading: compensated
+        # fields for the 2-D fit, raw ones and attitude for the 3-D fit
+        self.index = HeadingIndex(bins, slots, width=8)
+        # Every sector is covered, update() takes no more samples
+        self.complete = False
 
-        self.progress = set()
+    @property
+    def data(self):
+        """ (N, 2) array of collected [x, y] = [hx, hy], the axis order of calibration profiles """
+        return self.index.dataset()[:, :2]
 
-    def status(self):
-        return len(self.progress)
+    @property
+    def data3d(self):
+        """ (N, 3) array of collected raw [x, y, z], the fields tilt compensation is applied to """
+        return self.index.dataset()[:, 3:6]
+
+    @property
+    def attitude(self):
+        """ (N, 2) array of collected [roll, pitch] """
+        return self.index.dataset()[:, 6:8]
+
+    def ellipsoid_problem(self):
+        """ Reason why the collected samples do not constrain a 3-D fit, None if they do """
+        if len(self.index) < 9:
+            return "not enough samples"
+        roll, pitch = numpy.ptp(self.attitude, axis=0)
+        if min(roll, pitch) < self.ELLIPSOID_MIN_TILT:
+            return "heel {0:.0f}\u00b0 and trim {1:.0f}\u00b0 ranges, {2:.0f}\u00b0 needed".format(
+                roll, pitch, self.ELLIPSOID_MIN_TILT)
+        spread = self.data3d.std(axis=0)
+        if spread[2] < self.ELLIPSOID_MIN_Z_RATIO * max(spread[0], spread[1]):
+            return "vertical field hardly changes"
+        return None
 
-    def is_complete(self, value):
-        self.progress.add(int(value/10))
+    def status(self):
+        """ Angular coverage in bins """
+        return self.index.coverage
 
-        if len(self.progress) == 36:
-            return True
-        else:
-            return False
+    def is_complete(self):
+        return self.index.covered(self.SECTORS)
 
     def compute(self):
         print("Compute start")
-        maxdub = Algorithm(self.data)
+        inliers, self.rejected = algorithms.reject_outliers(self.data)
+        maxdub = self._fit(inliers, self.engine)
         # for y,x in self.data:
         #     yc, xc = maxdub.correct(x, y)
         #     self.result.append([y, x, yc, xc])
@@ -38,9 +130,40 @@ class Calibrate(object):
         # print("Compute Complete")
         return  maxdub
 
+    def compute_ellipsoid(self):
+        """ 3-D calibration of collected raw [x, y, z] fields
+
+        Return None, with the reason in ellipsoid_error, if the samples do not
+        constrain it (ellipsoid_problem()) or do not fit an ellipsoid.
+        """
+        self.ellipsoid_error = self.ellipsoid_problem()
+        if self.ellipsoid_error is not None:
+            return None
+        try:
+            inliers, _ = algorithms.reject_outliers(self.data3d)
+            return self._fit(inliers, algorithms.EllipsoidAlgorithm.engine)
+        except (ValueError, numpy.linalg.LinAlgError) as e:
+            self.ellipsoid_error = str(e)
+            return None
+
+    def _fit(self, fields, engine):
+        if self.cache is not None:
+            return self.cache.fit(self.sensor, fields, engine)
+        if engine == algorithms.EllipsoidAlgorithm.engine:
+            return algorithms.EllipsoidAlgorithm(fields)
+        return algorithms.fit(fields, engine)
+
+    def estimate(self):
+        """ Coefficients estimated from samples collected so far (None if not enough) """
+        return self.online.fit()
+
     def update(self, data):
-        if not self.is_complete(data[3]):
-            y, x = data[-3], data[-2]
-            self.data.append([y, x])
-        else:
+        if self.complete:
+            return
+        y, x = data[-3], data[-2]
+        roll, pitch, _, y_raw, x_raw, z_raw = data[1:7]
+        self.index.add(data[3], (x, y, data[-1], x_raw, y_raw, z_raw, roll, pitch))
+        self.online.update(x, y)
+        if self.is_complete():
+            self.complete = True
             print("Complete collection")
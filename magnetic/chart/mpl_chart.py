@@ -63,26 +63,68 @@ class BasePlot(FigureCanvas):
 
 
 class XYPlot(FigureCanvas):
+    """ Scatter of (x, y) points added incrementally
+
+    Points are kept in a preallocated offsets array. New points are drawn
+    by a small animated collection over the cached background, which is then
+    copied again, so adding a point does not redraw the old ones. All points
+    are drawn by one PathCollection only on full draws (resize, clear).
+
+    Above max_points every other stored point is dropped and only every
+    stride-th new point is kept. Above density_threshold received points the
+    chart shows a 2-D histogram of all points (bins x bins) instead.
+
+    append() only stores points, refresh() draws them (see chart.scheduler).
+    """
+    limits = (-50, 50)
+
     def __init__(self, parent=None, width=5, height=5, dpi=100,
                  cursor_visible=False,
-                 title='', ylabel='', xlabel=''):
+                 title='', ylabel='', xlabel='',
+                 max_points=200000, density_threshold=100000, bins=200):
 
         self.fig = Figure(figsize=(width, height), dpi=dpi)
         self.fig.suptitle(title, fontsize=10)
 
-        self.init_axes()
+        self.max_points = max_points
+        self.density_threshold = density_threshold
+        self.bins = bins
+        self.offsets = numpy.empty((max_points, 2))
+        self.background = None
+        self.full_draws = 0
 
-        self.xdata = []
-        self.ydata = []
+        self.init_axes()
 
         super(XYPlot, self).__init__(self.fig)
+        self.mpl_connect('draw_event', self.on_draw)
 
     def init_axes(self):
         self.axes = self.fig.add_subplot(111)
-        self.axes.set_xlim(-50, 50)
-        self.axes.set_ylim(-50, 50)
+        self.axes.set_xlim(*self.limits)
+        self.axes.set_ylim(*self.limits)
         self.axes.grid()
 
+        self.count = 0
+        self.received = 0
+        # Stored points drawn (None after decimation) and received points shown
+        self.drawn = 0
+        self.shown = 0
+        self.stride = 1
+        self.histogram = numpy.zeros((self.bins, self.bins))
+        # All stored points, synchronized with offsets before a full draw
+        self.points = self.axes.scatter([], [], marker='.', linewidths=0.2, color='C0')
+        # Points added since the last frame
+        self.new_points = self.axes.scatter([], [], marker='.', linewidths=0.2, color='C0', animated=True)
+        self.density = None
+
+    @property
+    def xdata(self):
+        return self.offsets[:self.count, 0]
+
+    @property
+    def ydata(self):
+        return self.offsets[:self.count, 1]
+
     def navigation_bar(self, parent):
         return NavigationToolbar(self, parent)
 
@@ -92,28 +134,114 @@ class XYPlot(FigureCanvas):
 
     def clear(self):
         self.axes.cla()
+        self.fig.delaxes(self.axes)
         self.init_axes()
         self.draw()
 
-    def update_plot(self, x, y):
-        self.axes.cla()
-        self.axes.set_xlim(-50, 50)
-        self.axes.set_ylim(-50, 50)
-        self.axes.grid()
+    def draw(self):
+        self.points.set_offsets(self.offsets[:self.count])
+        self.drawn = self.count
+        super(XYPlot, self).draw()
 
-        self.ydata.append(y)
-        self.xdata.append(x)
+    def on_draw(self, event):
+        """ Cache the background after a full draw """
+        self.full_draws += 1
+        self.background = self.copy_from_bbox(self.fig.bbox)
+        if self.density is not None:
+            self.fig.draw_artist(self.density)
 
-        self.axes.scatter(self.xdata, self.ydata, marker='.', linewidths=0.2)
+    def update_plot(self, x, y):
+        self.extend(((x, y),))
+
+    def extend(self, xy):
+        """ Add (N, 2) array of points and draw them """
+        self.append(xy)
+        self.refresh()
+
+    def append(self, xy):
+        """ Add (N, 2) array of points, they are drawn by the next refresh() """
+        xy = numpy.asarray(xy, dtype=float).reshape(-1, 2)
+        if not len(xy):
+            return
+
+        histogram, _, _ = numpy.histogram2d(xy[:, 0], xy[:, 1], bins=self.bins, range=(self.limits, self.limits))
+        self.histogram += histogram
+
+        # Decimation: keep every stride-th point, halve the stored ones when they do not fit
+        index = self.received + numpy.arange(len(xy))
+        self.received += len(xy)
+        kept = xy[index % self.stride == 0]
+        while self.count + len(kept) > self.max_points:
+            half = (self.count + 1) // 2
+            self.offsets[:half] = self.offsets[:self.count:2]
+            self.count = half
+            self.stride *= 2
+            kept = xy[index % self.stride == 0]
+            # Drawn points are not the stored ones any more
+            self.drawn = None
+        self.offsets[self.count:self.count + len(kept)] = kept
+        self.count += len(kept)
+
+    def refresh(self):
+        """ Draw the points added since the previous refresh, return False if there are none """
+        if self.received == self.shown:
+            return False
+        self.shown = self.received
+
+        if self.density is None and self.received > self.density_threshold:
+            self.show_density()
+        elif self.density is not None:
+            self.density.set_data(numpy.log1p(self.histogram.T))
+            self.density.set_clim(0, numpy.log1p(self.histogram.max()))
+            self._blit(self.density)
+        elif self.drawn is None:
+            self.draw()
+        else:
+            self.new_points.set_offsets(self.offsets[self.drawn:self.count])
+            self.drawn = self.count
+            self._blit(self.new_points)
+        return True
+
+    def show_density(self):
+        """ Replace the scatter by a 2-D histogram image """
+        self.points.set_visible(False)
+        self.density = self.axes.imshow(
+            numpy.log1p(self.histogram.T), origin='lower', extent=self.limits + self.limits,
+            aspect='auto', interpolation='nearest', cmap='Blues', animated=True)
+        self.density.set_clim(0, numpy.log1p(self.histogram.max()))
+        self.axes.set_xlim(*self.limits)
+        self.axes.set_ylim(*self.limits)
         self.draw()
 
+    def _blit(self, artist):
+        if self.background is None:
+            self.draw()
+            return
+        self.restore_region(self.background)
+        self.fig.draw_artist(artist)
+        self.blit(self.fig.bbox)
+        if artist is self.new_points:
+            # New points become a part of the background
+            self.background = self.copy_from_bbox(self.fig.bbox)
+
 
 class TimePlot(FigureCanvas):
+    """ Last xmax + 1 values of several lines
+
+    Values are kept in NumPy buffers of twice the capacity: every value is
+    written at i and i + capacity, so the last capacity values are always a
+    contiguous slice and appending is O(1). With blit=True only the lines
+    and the value labels are redrawn over the cached background, the whole
+    figure is drawn only when the y limits change or on resize.
+
+    append() only stores values, refresh() draws them, so values may arrive
+    faster than the chart is redrawn (see chart.scheduler).
+    """
     xmax = 100
     xmin = 0
 
     def __init__(self, parent=None, width=5, height=5, dpi=100, cursor_visible=False,
-                 title='', ylabel='', xlabel=''):
+                 title='', ylabel='', xlabel='', blit=True):
 
         self.fig = fig = Figure(figsize=(width, height), dpi=dpi)
         fig.suptitle(title, fontsize=10)
@@ -124,8 +252,20 @@ class TimePlot(FigureCanvas):
 
         super(TimePlot, self).__init__(fig)
 
-        self.xdata = []
+        self.blit_enabled = blit
+        self.background = None
+        self.full_draws = 0
+        self.mpl_connect('draw_event', self.on_draw)
+
+        self.lines = []
+        self.ybuffer = numpy.zeros((0, 2 * (self.xmax + 1)))
+        # Position of the next value and number of values
+        self.head = 0
+        self.count = 0
         self.tick = 0
+        # (min, max, last values) appended since the previous refresh
+        self.pending = None
+        self.scaled = False
 
         # self.text = self.axes.text(102, 0, '*', color='b', bbox=dict(facecolor='white', alpha=0.5))
         # self.text = self.axes.text(self.xmax+1, 0, '*')
@@ -137,9 +277,27 @@ class TimePlot(FigureCanvas):
             self.cursor = Cursor(self.axes)
             fig.canvas.mpl_connect('motion_notify_event', self.cursor.on_mouse_move)
 
+    @property
+    def capacity(self):
+        return self.xmax + 1
+
+    def ydata(self):
+        """ (lines, count) array of the shown values, oldest first """
+        start = (self.head - self.count) % self.capacity
+        return self.ybuffer[:, start:start + self.count]
+
     def set_xmax(self, xmax):
+        ydata = self.ydata()[:, -(xmax + 1):]
         self.xmax = xmax
+        self.ybuffer = numpy.zeros((len(self.lines), 2 * self.capacity))
+        self.count = 0
+        self.head = 0
+        if ydata.shape[1]:
+            self._store(ydata.T)
+        self._set_lines()
         self.axes.set_xlim(0, self.xmax)
+        for t in self.text_values:
+            t.set_x(self.xmax + 1)
         self.draw()
 
     def add_lines(self, labels):
@@ -147,10 +305,12 @@ class TimePlot(FigureCanvas):
             self.add_line(label)
 
     def add_line(self, label):
-        self.line, = self.axes.plot([], [], lw=1, label=label)
+        self.line, = self.axes.plot([], [], lw=1, label=label, animated=self.blit_enabled)
+        self.lines.append(self.line)
         self.legend = self.axes.legend()
+        self.ybuffer = numpy.vstack((self.ybuffer, numpy.zeros((1, self.ybuffer.shape[1]))))
 
-        txt = self.axes.text(self.xmax + 1, 0, '')
+        txt = self.axes.text(self.xmax + 1, 0, '', animated=self.blit_enabled)
         txt.set_color(self.legend.get_lines()[-1].get_color())
         self.text_values.append(txt)
 
@@ -158,43 +318,92 @@ class TimePlot(FigureCanvas):
         pass
 
     def clear(self):
-        self.axes.cla()
+        self.head = self.count = self.tick = 0
+        self.pending = None
+        self.scaled = False
+        self._set_lines()
+        for t in self.text_values:
+            t.set_text('')
+        self.draw()
 
     def update_plot(self, *ydatas):
-
-        # Set new data
-        if self.tick <= self.xmax:
-            # update x
-            self.xdata.append(self.tick)
-            self.tick += 1
-
-            # update y
-            for line, y in zip(self.axes.get_lines(), ydatas):
-                ydata = list(line.get_ydata())
-                ydata.append(y)
-                line.set_data(self.xdata, ydata)
+        """ Append one value of every line """
+        self.extend(numpy.array(ydatas, dtype=float).reshape(1, -1))
+
+    def extend(self, ydatas):
+        """ Append (N, lines) array of values and redraw """
+        self.append(ydatas)
+        self.refresh()
+
+    def append(self, ydatas):
+        """ Append (N, lines) array of values, they are drawn by the next refresh() """
+        ydatas = numpy.asarray(ydatas, dtype=float)
+        if not len(ydatas):
+            return
+        self._store(ydatas[-self.capacity:])
+        self.tick += len(ydatas)
+        if self.pending is None:
+            self.pending = (ydatas.min(), ydatas.max(), ydatas[-1].tolist())
         else:
-            for line, y in zip(self.axes.get_lines(), ydatas):
-                ydata = list(line.get_ydata())[1:]
-                ydata.append(y)
-                line.set_data(self.xdata, ydata)
+            self.pending = (min(self.pending[0], ydatas.min()), max(self.pending[1], ydatas.max()),
+                            ydatas[-1].tolist())
+
+    def refresh(self):
+        """ Draw the values appended since the previous refresh, return False if there are none """
+        if self.pending is None:
+            return False
+        min_ydatas, max_ydatas, last = self.pending
+        self.pending = None
+        self._set_lines()
+
+        for t, v in zip(self.text_values, last):
+            t.set_text("{}".format(v))
+            t.set_position((self.xmax + 1, v))
 
         # Autoscale
-        if self.tick == 1:
-            max_ydatas, min_ydatas = max(ydatas), min(ydatas)
-            self.axes.set_ylim(min_ydatas - 5, max_ydatas + 5)
+        if not self.scaled:
+            self.scaled = True
+            limits = (min_ydatas - 5, max_ydatas + 5)
         else:
             ymin, ymax = self.axes.get_ylim()
-            max_ydatas, min_ydatas = max(ydatas), min(ydatas)
-            ymin = ymin if min_ydatas > ymin else (min_ydatas - 1)
-            ymax = ymax if max_ydatas < ymax else (max_ydatas + 1)
-            self.axes.set_ylim(ymin, ymax)
-
-        for t, v in zip(self.text_values, ydatas):
-            t.set_text("{}".format(v))
-            t.set_position((self.xmax + 1, v))
-
-        self.draw()
+            limits = (ymin if min_ydatas > ymin else (min_ydatas - 1),
+                      ymax if max_ydatas < ymax else (max_ydatas + 1))
+
+        if limits != tuple(self.axes.get_ylim()):
+            self.axes.set_ylim(*limits)
+            self.draw()
+        elif self.blit_enabled and self.background is not None:
+            self.restore_region(self.background)
+            self._draw_animated()
+            self.blit(self.fig.bbox)
+        else:
+            self.draw()
+        return True
+
+    def on_draw(self, event):
+        """ Cache the background after a full draw, animated artists are drawn over it """
+        self.full_draws += 1
+        if self.blit_enabled:
+            self.background = self.copy_from_bbox(self.fig.bbox)
+            self._draw_animated()
+
+    def _draw_animated(self):
+        for artist in self.lines + self.text_values:
+            self.fig.draw_artist(artist)
+
+    def _store(self, ydatas):
+        """ Write (N <= capacity, lines) values to the buffer """
+        n = len(ydatas)
+        index = (self.head + numpy.arange(n)) % self.capacity
+        self.ybuffer[:, index] = ydatas.T
+        self.ybuffer[:, index + self.capacity] = ydatas.T
+        self.head = (self.head + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    def _set_lines(self):
+        xdata = numpy.arange(self.count)
+        for line, ydata in zip(self.lines, self.ydata()):
+            line.set_data(xdata, ydata)
 
 
 class SimplePlot(FigureCanvas):
@@ -0,0 +1,82 @@
+""" Redraw of charts at a fixed frame rate
+
+    Data is appended to the charts (TimePlot.append, XYPlot.append) as fast
+    as it comes, RefreshScheduler calls refresh() of the visible ones every
+    1/fps seconds. Charts hidden in a QStackedLayout keep their data and
+    are drawn when they are shown again. A frame longer than 1/fps delays
+    the next one to the next frame boundary, the data of the skipped frames
+    is drawn by it at once.
+"""
+import time
+
+from PyQt5 import QtCore
+
+
+class RefreshScheduler(QtCore.QObject):
+    """ Refresh charts at fps frames per second
+
+    measured(fps, skipped) is emitted every second with the frames per
+    second achieved and the frames skipped because of overruns.
+    """
+    measured = QtCore.pyqtSignal(float, int)
+
+    def __init__(self, charts=(), fps=25, parent=None):
+        super().__init__(parent)
+        self.charts = list(charts)
+        self.fps = fps
+
+        self.frames = 0
+        self.skipped = 0
+        self.overruns = 0
+
+        self._period_start = time.monotonic()
+        self._period_frames = 0
+        self._period_skipped = 0
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.frame)
+
+    @property
+    def budget(self):
+        """ Seconds of a frame """
+        return 1.0 / self.fps
+
+    def add(self, chart):
+        if chart not in self.charts:
+            self.charts.append(chart)
+
+    def start(self):
+        self._period_start = time.monotonic()
+        self._period_frames = self._period_skipped = 0
+        self._timer.start(0)
+
+    def stop(self):
+        self._timer.stop()
+
+    def frame(self):
+        """ Refresh visible charts, schedule the next frame """
+        started = time.monotonic()
+        drawn = False
+        for chart in self.charts:
+            if chart.isVisible():
+                drawn = chart.refresh() or drawn
+        now = time.monotonic()
+        elapsed = now - started
+
+        if drawn:
+            self.frames += 1
+            self._period_frames += 1
+        budget = self.budget
+        if elapsed > budget:
+            # Coalesce: skip the frames the overrun took, their data goes to the next one
+            self.overruns += 1
+            self.skipped += int(elapsed // budget)
+            self._period_skipped += int(elapsed // budget)
+
+        if now - self._period_start >= 1.0:
+            self.measured.emit(self._period_frames / (now - self._period_start), self._period_skipped)
+            self._period_start = now
+            self._period_frames = self._period_skipped = 0
+
+        self._timer.start(int(round((budget - elapsed % budget) * 1000)))
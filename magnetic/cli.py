@@ -0,0 +1,288 @@
+""" Headless modes, never import PyQt5 or matplotlib
+
+    python cli.py --mode record --port /dev/ttyUSB0 --port /dev/ttyUSB1 --output session.rec --duration 600
+    python cli.py --mode apply --data session.rec --profile /dev/ttyUSB0 --output corrected.csv
+    python cli.py --mode process --data session.rec --profile /dev/ttyUSB0 --output out.log
+    python cli.py --mode process --port /dev/ttyUSB0 --duration 60 --tilt --output out.log
+    python cli.py --mode stats --data session.rec
+
+    record:  record frames of ports to a recording.Recording at full rate
+    apply:   apply the saved calibration profile of a sensor to a recording,
+             a CSV log or a CSV dataset of "hy,hx" fields, write CSV (or .npy)
+    process: run the GUI pipeline stages (rounding, tilt compensation,
+             correction) over a recording, a CSV log or a port, write a text log
+    stats:   print summary statistics of a recording or a CSV
+
+    Errors of the input files are printed as one line, the exit status is 1.
+"""
+import csv
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy
+
+from pipeline import VALUES, Correct, Log, Pipeline, Round, Tilt, make_batch, recording_batches, sensor_batches, values
+from profiles import ProfileStore
+from util import get_arguments
+
+MODES = ('record', 'apply', 'process', 'stats')
+
+
+def read_csv(path):
+    """ Return ('log', batch) of a text log written by the GUI or ('fields', (N, 2) array of [hx, hy]) of a dataset
+
+    The GUI writes "hy,hx" rows of calibration collection to the same log,
+    they are skipped in a log.
+    """
+    with open(path) as f:
+        rows = [row for row in csv.reader(f) if row]
+    frames = [row for row in rows if len(row) == 2 + len(VALUES)]
+    if frames:
+        times = [datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S.%f").timestamp() for row in frames]
+        return 'log', make_batch(times, numpy.array([row[2:] for row in frames], dtype=float))
+    if rows and all(len(row) in (2, 4) for row in rows):
+        # Datasets are written as "hy,hx", fields are [hx, hy] as profiles take them
+        return 'fields', numpy.array(rows, dtype=float)[:, [1, 0]]
+    raise ValueError("{} is neither a log nor a dataset".format(path))
+
+
+def load(path):
+    """ Return ('batches', iterable of batches) of a recording or a CSV log, ('fields', array) of a CSV dataset """
+    if not path.lower().endswith('.csv'):
+        return 'batches', recording_batches(path)
+    kind, data = read_csv(path)
+    return ('fields', data) if kind == 'fields' else ('batches', [data])
+
+
+class Summary(object):
+    """ Running statistics of batches """
+
+    def __init__(self):
+        self.count = 0
+        self.start = None
+        self.end = None
+        self.ports = {}
+        self.minimum = numpy.full(len(VALUES), numpy.inf)
+        self.maximum = numpy.full(len(VALUES), -numpy.inf)
+        self.total = numpy.zeros(len(VALUES))
+        self.squares = numpy.zeros(len(VALUES))
+        # Headings seen in 10 grad sectors
+        self.sectors = numpy.zeros(36, dtype=bool)
+
+    def update(self, batch):
+        if not len(batch):
+            return
+        rows = values(batch)
+        self.count += len(rows)
+        self.start = batch['time'][0] if self.start is None else self.start
+        self.end = batch['time'][-1]
+        ports, counts = numpy.unique(batch['port'], return_counts=True)
+        for port, count in zip(ports.tolist(), counts.tolist()):
+            self.ports[port] = self.ports.get(port, 0) + count
+        self.minimum = numpy.minimum(self.minimum, rows.min(axis=0))
+        self.maximum = numpy.maximum(self.maximum, rows.max(axis=0))
+        self.total += rows.sum(axis=0)
+        self.squares += (rows ** 2).sum(axis=0)
+        self.sectors[(rows[:, 2] % 360.0 // 10).astype(int) % 36] = True
+
+    def report(self, out=sys.stdout):
+        if not self.count:
+            print("no frames", file=out)
+            return
+        duration = self.end - self.start
+        print("frames: {0}, duration: {1:.1f} s, rate: {2:.1f} frames/s".format(
+            self.count, duration, self.count / duration if duration > 0 else 0.0), file=out)
+        print("ports: " + ", ".join("{0}: {1}".format(port, count) for port, count in sorted(self.ports.items())),
+              file=out)
+        print("heading coverage: {0} of 36 sectors".format(int(self.sectors.sum())), file=out)
+        mean = self.total / self.count
+        std = numpy.sqrt(numpy.maximum(self.squares / self.count - mean ** 2, 0.0))
+        print("{0:>8} {1:>9} {2:>9} {3:>9} {4:>9}".format("", "min", "max", "mean", "std"), file=out)
+        for i, name in enumerate(VALUES):
+            print("{0:>8} {1:9.2f} {2:9.2f} {3:9.2f} {4:9.2f}".format(
+                name, self.minimum[i], self.maximum[i], mean[i], std[i]), file=out)
+
+
+def record(args):
+    from serial import SerialException
+
+    from acquisition import Acquisition
+    from recording import RecordWriter
+    from sensor import scan_ports
+
+    ports = args.ports or scan_ports()
+    if not ports:
+        print("no available ports", file=sys.stderr)
+        return 1
+    output = args.output or time.strftime("recording-%Y%m%d-%H%M%S.rec")
+
+    with RecordWriter(output) as writer:
+        acquisition = Acquisition(ports, recorder=writer)
+        try:
+            acquisition.start()
+        except SerialException as e:
+            print("cannot open port: {}".format(e), file=sys.stderr)
+            writer.close()
+            os.remove(output)
+            return 1
+        # stop() forgets the sensors, their counters are reported after it
+        sensors = dict(acquisition.sensors)
+        acquisition.throughput()
+        stop = None if args.duration is None else time.monotonic() + args.duration
+        try:
+            while acquisition.running and (stop is None or time.monotonic() < stop):
+                time.sleep(1.0 if stop is None else max(0.0, min(1.0, stop - time.monotonic())))
+                # Frames are in the recording already, the buffers are only emptied
+                acquisition.drain()
+                _, total = acquisition.throughput()
+                print("{0:.0f} frames/s, {1:.0f} B/s, {2} frames recorded".format(
+                    total.frames, total.bytes, writer.frames), flush=True)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            acquisition.stop()
+    for port, sensor in sensors.items():
+        print("{0}: {1} frames, {2} errors, {3} lost".format(
+            port, sensor.buffer.received, sensor.errors, sensor.overflows))
+    print("{0} frames written to {1}".format(writer.frames, output))
+    return 0
+
+
+def apply(args):
+    if not args.path_to_dataset or not args.profile:
+        print("apply needs --data and --profile", file=sys.stderr)
+        return 2
+    correction = ProfileStore().load(args.profile)
+    if correction is None:
+        print("no calibration profile of {}".format(args.profile), file=sys.stderr)
+        return 1
+    output = args.output or args.path_to_dataset.rsplit('.', 1)[0] + '.corrected.csv'
+
+    kind, data = load(args.path_to_dataset)
+    if kind == 'fields':
+        xy = data
+        result = numpy.column_stack((xy, correction.correct_array(xy), correction.correct_heading_array(xy)))
+        if output.lower().endswith('.npy'):
+            numpy.save(output, result)
+        else:
+            with open(output, 'w', newline='') as f:
+                csv.writer(f).writerows(result.round(3).tolist())
+        print("{0} rows written to {1}".format(len(result), output))
+        return 0
+
+    columns = ['time', 'port'] + list(VALUES) + ['heading_corrected']
+    pipeline = Pipeline([Correct(correction)])
+    if output.lower().endswith('.npy'):
+        batches = [batch[columns] for batch in pipeline.run(data)]
+        numpy.save(output, numpy.concatenate(batches) if batches else make_batch([], numpy.empty((0, 9)))[columns])
+    else:
+        # Written batch by batch, recordings may be bigger than memory
+        with open(output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for batch in pipeline.run(data):
+                writer.writerows(batch[columns].tolist())
+    print("{0} rows written to {1}".format(pipeline.frames, output))
+    return 0
+
+
+def process(args):
+    from logwriter import LogWriter
+
+    correction = None
+    if args.profile:
+        correction = ProfileStore().load(args.profile)
+        if correction is None:
+            print("no calibration profile of {}".format(args.profile), file=sys.stderr)
+            return 1
+
+    acquisition = None
+    if args.path_to_dataset:
+        kind, batches = load(args.path_to_dataset)
+        if kind == 'fields':
+            print("process needs a recording or a log, {} is a dataset".format(args.path_to_dataset), file=sys.stderr)
+            return 2
+    elif args.ports:
+        from serial import SerialException
+
+        from acquisition import Acquisition
+        port = args.ports[0]
+        acquisition = Acquisition([port])
+        try:
+            acquisition.start()
+        except SerialException as e:
+            print("cannot open port: {}".format(e), file=sys.stderr)
+            return 1
+        batches = sensor_batches(acquisition.sensors[port], duration=args.duration)
+    else:
+        print("process needs --data or --port", file=sys.stderr)
+        return 2
+
+    stages = [Round(1)]
+    if args.tilt:
+        stages.append(Tilt())
+    stages.append(Correct(correction))
+    writer = None
+    if args.output:
+        writer = LogWriter(args.output)
+        stages.append(Log(writer))
+    pipeline = Pipeline(stages)
+
+    try:
+        for _ in pipeline.run(batches):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if acquisition is not None:
+            acquisition.stop()
+        pipeline.close()
+    print("{0} frames in {1} batches".format(pipeline.frames, pipeline.batches))
+    if writer is not None and writer.error is not None:
+        print("log {0}: {1}, {2} rows dropped".format(args.output, writer.error, writer.dropped), file=sys.stderr)
+        return 1
+    return 0
+
+
+def stats(args):
+    if not args.path_to_dataset:
+        print("stats needs --data", file=sys.stderr)
+        return 2
+    kind, data = load(args.path_to_dataset)
+    if kind == 'fields':
+        xy = data
+        radius = numpy.hypot(*(xy - (xy.max(axis=0) + xy.min(axis=0)) / 2).T)
+        print("samples: {0}".format(len(xy)))
+        print("x: {0:.2f} .. {1:.2f}, y: {2:.2f} .. {3:.2f}".format(
+            xy[:, 0].min(), xy[:, 0].max(), xy[:, 1].min(), xy[:, 1].max()))
+        print("radius: {0:.2f} .. {1:.2f}".format(radius.min(), radius.max()))
+        return 0
+
+    summary = Summary()
+    for batch in data:
+        summary.update(batch)
+    summary.report()
+    return 0
+
+
+def run(args):
+    """ Run headless mode args.mode, return exit status """
+    try:
+        return {'record': record, 'apply': apply, 'process': process, 'stats': stats}[args.mode](args)
+    except (OSError, ValueError) as e:
+        print("{0}: {1}".format(args.mode, e), file=sys.stderr)
+        return 1
+
+
+def main():
+    args = get_arguments()
+    if args.mode not in MODES:
+        print("--mode must be one of: {}".format(', '.join(MODES)), file=sys.stderr)
+        return 2
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import gzip
+import os
+import queue
+import threading
+import time
+
+
+class LogWriter(object):
+    """ Background writer of text log rows
+
+    Rows are put to a bounded queue and written by a dedicated thread in
+    batches, the file is flushed when batch_size rows are collected or
+    flush_interval seconds are passed. Rows which do not fit to the queue
+    are counted in dropped, the caller never waits for the disk.
+
+    The file is rotated (log.csv -> log.1.csv, log.2.csv, ...) when it is
+    bigger than max_bytes or older than max_duration seconds. With
+    compress=True the files are written as gzip streams (log.csv.gz).
+
+    An I/O error of the thread is kept in error, rows of the failed batch
+    are counted in dropped and the next batch opens the file again.
+    """
+
+    def __init__(self, path, max_queue=10000, batch_size=500, flush_interval=1.0,
+                 max_bytes=None, max_duration=None, compress=False):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_duration = max_duration
+        self.compress = compress
+
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.dropped = 0
+        self.part = 0
+        self.error = None
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._file = None
+        self._file_bytes = 0
+        self._file_opened = 0.0
+        self._thread = threading.Thread(target=self.run, name="log writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def current_path(self):
+        root, ext = os.path.splitext(self.path)
+        path = "{0}.{1}{2}".format(root, self.part, ext) if self.part else self.path
+        return path + '.gz' if self.compress else path
+
+    def write(self, row):
+        """ Queue a row (a str with line ending) to be written """
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout=5.0):
+        """ Write every queued row and close the file, wait for the thread at most timeout seconds
+
+        Return False if the thread is still writing after timeout.
+        """
+        self._stop.set()
+        try:
+            # Wake up the thread, a full queue wakes it up anyway
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def run(self):
+        batch = []
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            timeout = max(0.0, last_flush + self.flush_interval - time.monotonic())
+            try:
+                row = self._queue.get(timeout=timeout)
+                if row is not None:
+                    batch.append(row)
+                    # Take whatever is already waiting without blocking
+                    while len(batch) < self.batch_size:
+                        row = self._queue.get_nowait()
+                        if row is None:
+                            break
+                        batch.append(row)
+            except queue.Empty:
+                pass
+            # Stop when everything queued before close() is taken
+            if self._stop.is_set() and self._queue.empty():
+                running = False
+
+            if batch and (len(batch) >= self.batch_size or not running or
+                          time.monotonic() - last_flush >= self.flush_interval):
+                try:
+                    self._write_batch(batch)
+                except OSError as e:
+                    self.error = e
+                    self.dropped += len(batch)
+                    self._close_file()
+                batch = []
+                last_flush = time.monotonic()
+            elif not batch:
+                last_flush = time.monotonic()
+
+        self._close_file()
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError as e:
+                self.error = e
+            self._file = None
+
+    def _write_batch(self, batch):
+        if self._file is not None and self._need_rotation():
+            self._close_file()
+            self.part += 1
+        if self._file is None:
+            self._open()
+
+        data = ''.join(batch)
+        self._file.write(data)
+        self._file.flush()
+        self.rows_written += len(batch)
+        self.bytes_written += len(data)
+        self._file_bytes += len(data)
+
+    def _need_rotation(self):
+        if self.max_bytes is not None and self._file_bytes >= self.max_bytes:
+            return True
+        if self.max_duration is not None and time.monotonic() - self._file_opened >= self.max_duration:
+            return True
+        return False
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self.compress:
+            self._file = gzip.open(self.current_path, 'at')
+        else:
+            self._file = open(self.current_path, 'a')
+        self._file_bytes = 0
+        self._file_opened = time.monotonic()
@@ -1,10 +1,13 @@
+import os
 import sys
 
+import numpy
 from PyQt5 import QtCore
 from PyQt5.QtWidgets import QMainWindow, QWidget, QAction, QHBoxLayout, QLabel, QDoubleSpinBox, \
 	QSpacerItem, QSizePolicy, QPushButton, QSplitter, QVBoxLayout, QFileDialog, QApplication
 
-from algorithms import Algorithm
+from algorithms import reject_outliers
+from cache import CalibrationCache
 from chart.mpl_chart import XYPlot
 from models import SensorFieldModel
 from util import from_csv, to_csv, get_arguments
@@ -112,6 +115,10 @@ class MagneticViewer(Ui):
 		self.model = SensorFieldModel()
 		self.table.setModel(self.model)
 
+		# Results are cached by the name of the loaded file
+		self.cache = CalibrationCache()
+		self.source = title or "viewer"
+
 		self.buttons['add'].clicked.connect(self.add_xy)
 		self.buttons['clear'].clicked.connect(self.delete_all)
 		self.buttons['calibrate'].clicked.connect(self.calibrate)
@@ -129,22 +136,19 @@ class MagneticViewer(Ui):
 			self.status.showMessage("No loaded data")
 			return
 
-		dataset_initial = self.model.fetch_data()
-		maxdub = Algorithm(dataset_initial)
-		dataset_correction = [maxdub.correct(x, y) for (x, y) in dataset_initial]
+		dataset_initial = numpy.array(self.model.fetch_data(), dtype=float)[:, :2]
+		inliers, rejected = reject_outliers(dataset_initial)
+		maxdub = self.cache.fit(self.source, inliers)
+		self.status.showMessage("{} outliers rejected".format(rejected))
+		dataset_correction = numpy.round(maxdub.correct_array(dataset_initial), 1)
 		
-		union_ = [(x, y, round(xc, 1), round(yc, 1)) for (x, y), (xc, yc) in zip(dataset_initial, dataset_correction)]
+		union_ = numpy.column_stack((dataset_initial, dataset_correction)).tolist()
 		self.model.reset()
 		self.model.load_data(union_)
 		# self.chartwidget.add_graph(name="Correction Magnitude", model=self.model, xcol=2, ycol=3)
 		#print(self.model.fetch_data())
 
-		xdata = []
-		ydata = []
-		for (_, _, x, y) in self.model.fetch_data():
-			xdata.append(x)
-			ydata.append(y)
-		self.chartwidget.set_data(xdata, ydata)
+		self.chartwidget.set_data(dataset_correction[:, 0], dataset_correction[:, 1])
 
 
 	def action_open(self):
@@ -162,6 +166,7 @@ class MagneticViewer(Ui):
 			dataset = from_csv(fname)
 			self.status.showMessage(f"Load data", 1000)
 			self.setWindowTitle(self.app_title.format(fname))
+			self.source = os.path.basename(fname)
 
 			self.model.reset()
 			self.model.load_data(dataset)
@@ -199,8 +204,8 @@ class MagneticViewer(Ui):
 		self.move(frameGm.topLeft())
 
 
-def main():
-	app = QApplication(sys.argv)
+def main(argv=None):
+	app = QApplication(sys.argv if argv is None else argv)
 	
 	if sys.platform == 'win32':
 		import ctypes
@@ -246,5 +251,5 @@ def main():
 
 
 if __name__ == '__main__':
-	args = get_arguments()
-	main()
+	args, qt_args = get_arguments(known=True)
+	main(sys.argv[:1] + qt_args)
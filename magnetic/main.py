@@ -1,20 +1,26 @@
 import os
 import sys
 import platform
-import threading
-import queue
 
-import serial
+from util import get_arguments
+
+if __name__ == '__main__':
+    # Headless modes run without importing Qt and matplotlib
+    # Qt options (-platform, -style, ...) are passed to QApplication
+    args, qt_args = get_arguments(known=True)
+    if args.mode is not None:
+        import cli
+        if args.mode not in cli.MODES:
+            sys.exit("--mode must be one of: {}".format(', '.join(cli.MODES)))
+        sys.exit(cli.run(args))
+
 from PyQt5 import QtCore
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 
-import sensor
-from algorithms import to_horizont
-from calibrate import Calibrate
-from chart.mpl_chart import TimePlot, XYPlot
+# numpy, pyserial and matplotlib are imported when they are needed first,
+# so the window is shown before they are loaded
 from models import SensorDataModel
-from util import get_arguments
 from widgets import DataView, OptionsBox, SensorDataTable
 
 
@@ -45,7 +51,7 @@ class MagneticMonitor(QDialog):
         self.data_view2 = dv_widget2.views
 
         option_box = OptionsBox(title="Algorithm",
-            option_names=("dub z", "dub soft-iron", "update charts" ))
+            option_names=("dub z", "dub 3-D", "dub soft-iron", "update charts" ))
         self.options = option_box.options
 
         # Left dock layouts 
@@ -66,8 +72,32 @@ class MagneticMonitor(QDialog):
         layout = QVBoxLayout(frame)
         self.frame = frame
 
-        # Графики
+        # Графики, created by create_charts()
         self.charts = {}
+        self.chart_layout = layout
+
+        stack_layout = self.stack = QStackedLayout()
+        stack_layout.addWidget(self.frame)
+
+        # Таблица данных
+        self.table_view = SensorDataTable(self)
+        stack_layout.addWidget(self.table_view)
+
+        # График зависимости Hx от Hy, replaced by deviation_chart() when it is opened
+        stack_layout.addWidget(QWidget(self))
+
+        content_layout = QVBoxLayout()
+        content_layout.addLayout(stack_layout, 2)
+
+        # Central Layout
+        centralLayout = QHBoxLayout(self)
+        centralLayout.addLayout(left_dock)
+        centralLayout.addLayout(content_layout, 2)
+
+    def create_charts(self):
+        """ Create time charts (loads matplotlib) """
+        from chart.mpl_chart import TimePlot
+        layout = self.chart_layout
 
         # График курса
         chart = TimePlot(self, title='Heading')
@@ -87,25 +117,17 @@ class MagneticMonitor(QDialog):
         layout.addWidget(chart)
         self.charts['magnitometer'] = chart
 
-        stack_layout = self.stack = QStackedLayout()
-        stack_layout.addWidget(self.frame)
-
-        # Таблица данных
-        self.table_view = SensorDataTable(self)
-        stack_layout.addWidget(self.table_view)
-
-        # График зависимости Hx от Hy
-        chart = XYPlot()
-        self.charts['deviation'] = chart
-        stack_layout.addWidget(chart)
-
-        content_layout = QVBoxLayout()
-        content_layout.addLayout(stack_layout, 2)
-
-        # Central Layout
-        centralLayout = QHBoxLayout(self)
-        centralLayout.addLayout(left_dock)
-        centralLayout.addLayout(content_layout, 2)
+    def deviation_chart(self):
+        """ Return the chart of Hx from Hy, create it on the first call """
+        if 'deviation' not in self.charts:
+            from chart.mpl_chart import XYPlot
+            chart = XYPlot()
+            placeholder = self.stack.widget(2)
+            self.stack.insertWidget(2, chart)
+            self.stack.removeWidget(placeholder)
+            placeholder.deleteLater()
+            self.charts['deviation'] = chart
+        return self.charts['deviation']
 
 
 class MainWindow(QMainWindow):
@@ -151,6 +173,10 @@ class MainWindow(QMainWindow):
         self.statusBar().addPermanentWidget(self.counter)
         self.errors = QLabel("Err: -")
         self.statusBar().addPermanentWidget(self.errors)
+        self.log_status = QLabel("Log: -")
+        self.statusBar().addPermanentWidget(self.log_status)
+        self.fps_status = QLabel("FPS: -")
+        self.statusBar().addPermanentWidget(self.fps_status)
 
     def create_menu(self):
         self.menus = {}
@@ -274,7 +300,9 @@ class MainWindow(QMainWindow):
         compensation_bar.addWidget(check)
         
         progress = QProgressBar()
-        progress.setMaximum(36)
+        # Angular coverage of the collection, one step per grad
+        progress.setMaximum(360)
+        progress.setFormat('%v\u00b0')
         progress.setValue(0)
         self.progress = progress
         compensation_bar.addWidget(progress)
@@ -302,7 +330,8 @@ class MainWindow(QMainWindow):
 
     def _action_rescan(self):
         # TODO: Move to app
-        available = sensor.scan_ports()
+        from sensor import scan_ports
+        available = scan_ports()
         if available:
             self.portbox.clear()
             self.portbox.addItems(available)
@@ -327,6 +356,13 @@ class MainWindow(QMainWindow):
 class MagneticApp(MainWindow):
     app_title = "Magnetic Viewer - {0}"
     TIMEOUT = 100
+    # Rows kept in the table, rows shown per snapshot
+    MODEL_ROWS = 10000
+    SNAPSHOT_ROWS = 1000
+    # Charts are redrawn FPS times per second, independently of TIMEOUT
+    FPS = 25
+    # processing.Snapshot from the processing thread
+    snapshot_ready = QtCore.pyqtSignal(object)
 
     def __init__(self, data=None, title=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -340,21 +376,21 @@ class MagneticApp(MainWindow):
 
         # Start/Stop compensate
         self.compensate = False
+        self.ellipsoid = None
+        self.calibration_cache = None
+        # Saved calibration of every port, self.maxdub is the one of the selected port
+        self.profiles = None
+        self.maxdub = None
+
+        # Compensate view (magnetic_viewer.MagneticViewer)
+        self.viewer = None
 
         # On/Off logging data
         self.logging_enable = False
-
-        # Search available serial ports
-        available_ports = sensor.scan_ports()
-        if not available_ports:
-            self.status.showMessage("No available ports")
-            for btn in self.modeButtonGroup.buttons():
-                btn.setDisabled(True)
-        else:
-            self.portbox.addItems(available_ports)
+        self.log_writer = None
 
         # Connecting model to consumers
-        self.model = SensorDataModel()
+        self.model = SensorDataModel(max_rows=self.MODEL_ROWS)
         self.centralWidget().table_view.setModel(self.model)
 
         # Connecting signal/slot
@@ -374,74 +410,135 @@ class MagneticApp(MainWindow):
         # ...models
         self.model.rowsInserted.connect(self.on_model_changed)
 
-    def on_model_changed(self):
-        self.counter.setText("Rx: {}".format(self.model.rowCount()))
+        # ...processing thread
+        self.processor = None
+        self.refresher = None
+        self.snapshot_ready.connect(self.on_snapshot)
 
-    def timerEvent(self, QTimerEvent):
-        """ Handler timer event, every 100ms"""
+        # The rest is done when the window is shown
+        QtCore.QTimer.singleShot(0, self.on_startup)
 
-        # <1> Get data from sensor
-        try:
-            data = [round(item, 1) for item in sensor.SENSOR_QUEUE.get(timeout=0.5)]
-        except queue.Empty:
+    def on_startup(self):
+        """ Create charts, search ports and load calibrations """
+        from cache import CalibrationCache
+        from chart.scheduler import RefreshScheduler
+        from profiles import ProfileStore
+        from sensor import scan_ports
+
+        self.centralWidget().create_charts()
+        self.refresher = RefreshScheduler(self.charts.values(), fps=self.FPS, parent=self)
+        self.refresher.measured.connect(self.on_refresh_measured)
+        self.refresher.start()
+
+        self.calibration_cache = CalibrationCache()
+        self.profiles = ProfileStore()
+
+        # Search available serial ports
+        available_ports = scan_ports()
+        if not available_ports:
+            self.status.showMessage("No available ports")
+            for btn in self.modeButtonGroup.buttons():
+                btn.setDisabled(True)
+        else:
+            self.portbox.addItems(available_ports)
+
+        self.portbox.currentTextChanged.connect(self.on_port_changed)
+        self.on_port_changed(self.portbox.currentText())
+
+    def on_port_changed(self, port):
+        """ Load saved calibration of the selected port """
+        self.maxdub = self.profiles.load(port) if port else None
+        if self.maxdub is not None:
+            self.status.showMessage("Calibration of {} loaded".format(port), 1000)
+
+    def on_model_changed(self):
+        # The table keeps only the last rows, count every processed one
+        rows = self.processor.rows_processed if self.processor is not None else self.model.rowCount()
+        self.counter.setText("Rx: {}".format(rows))
+
+    def on_snapshot(self, snapshot):
+        """ Show rows processed since the previous snapshot, every TIMEOUT ms """
+        if not self.monitor_running:
+            # Queued before on_stop(), its log writer is closed already
+            return
+        self.errors.setText("Err: {0} Lost: {1}".format(
+            self.errors_data if self.errors_data <= 10000 else ">10000",
+            snapshot.overflows))
+        if self.log_writer is not None:
+            self.show_log_status(self.log_writer)
+        self.update_processor()
+
+        if not len(snapshot.rows):
             self.status.showMessage("No sensor data")
-            
             if self.errors_data <= 10000:
                 self.errors_data += 1
-                self.errors.setText("Err: {}".format(self.errors_data))
-            else:
-                self.errors.setText("Err: {}".format(">10000"))
             return
 
-        pid, r, p, h, hy_raw, hx_raw, hz_raw, hy, hx, hz = data
+        rows = snapshot.rows.tolist()
+        self.model.extend_data([tuple(row) for row in rows])
 
-        # <2> Append data to model
-        self.model.append_data((r, p, h, hy_raw, hx_raw, hz_raw, hy, hx, hz))
+        # Live calibration coefficients while collecting
+        if snapshot.coverage is not None:
+            self.progress.setValue(snapshot.coverage)
+        if snapshot.estimate is not None:
+            self.status.showMessage(
+                "x0={0.x_offset:.2f} y0={0.y_offset:.2f} k={0.k:.3f} "
+                "A={0.A:.3f} B={0.B:.3f} C={0.C:.3f} D={0.D:.3f}".format(snapshot.estimate))
+
+        r, p, h, hy_raw, hx_raw, hz_raw, hy, hx, hz = rows[-1]
 
         # <4> Show to data view
         self.data_view.update(r, p, h, hy_raw, hx_raw, hz_raw, hy, hx, hz)
 
-        # <3> Apply correction algorithms
-        if self.options['dub z'].checkState():
-            hy_raw, hx_raw, hz_raw = to_horizont(hy_raw, hx_raw, hz_raw, r, p)
-
-        if self.options['dub soft-iron'].checkState():
-            try:
-                heading = self.maxdub.correct_heading(hx, hy)
-                fmt_value = '{0:.1f}'
-                self.data_view2['heading'].setText(fmt_value.format(heading))
-            except AttributeError:
-                self.options['dub soft-iron'].setCheckState(False)
-                self.status.showMessage("Error! Please, calibrate", 1000)
-
-
-        self.charts['inclinometer'].update_plot(r, p)
-        self.charts['heading'].update_plot(h)
-        self.charts['magnitometer'].update_plot(hy, hx, hz)
-            #FIXME: При включения графика девиации увеличивается в разы количество пропущенных сигналов
-            #self.charts['deviation'].update_plot(hy, hx)
-
-        # <6> Logging data
-        if self.logging_enable:
-            time = QtCore.QDateTime.currentDateTime().toString("yyyy-MM-dd hh:mm:ss.zzz")
-            path = self.lineedit.text()
-            str_data = ",".join((str(x) for x in (time, hex(pid), r, p, h, hy_raw, hx_raw, hz_raw, hy, hx, hz)))
-            str_data += '\n'
-            self.status.showMessage(time)
-            with open(path, 'a') as f:
-                f.write(str_data)
-
-        # <7> Compensate mode
-        if self.compensate:
-            self.calibrate.update(data)
-            self.progress.setValue(self.calibrate.status())
-            time = QtCore.QDateTime.currentDateTime().toString("yyyy-MM-dd hh:mm:ss.zzz")
-            path = self.lineedit.text()
-            #str_data = ",".join((str(x) for x in (time, hex(pid), r, p, h, hy_raw, hx_raw, hz_raw, hy, hx, hz)))
-            str_data = ",".join((str(x) for x in (hy, hx)))
-            str_data += '\n'
-            with open(path, 'a') as f:
-                f.write(str_data)
+        if snapshot.heading is not None:
+            self.data_view2['heading'].setText('{0:.1f}'.format(snapshot.heading))
+
+        # Rows of the snapshot go to the charts, they are drawn by self.refresher
+        self.charts['inclinometer'].append(snapshot.rows[:, 0:2])
+        self.charts['heading'].append(snapshot.rows[:, 2:3])
+        self.charts['magnitometer'].append(snapshot.rows[:, 6:9])
+        if 'deviation' in self.charts:
+            self.charts['deviation'].append(snapshot.rows[:, 6:8])
+
+    def on_refresh_measured(self, fps, skipped):
+        self.fps_status.setText("FPS: {0:.0f}".format(fps) + (" ({} skipped)".format(skipped) if skipped else ""))
+
+    def update_processor(self):
+        """ Pass options to the processing thread """
+        if self.options['dub soft-iron'].checkState() and self.maxdub is None:
+            self.options['dub soft-iron'].setCheckState(False)
+            self.status.showMessage("Error! Please, calibrate", 1000)
+        self.processor.correct.correction = self.maxdub if self.options['dub soft-iron'].checkState() else None
+        if self.options['dub 3-D'].checkState() and self.ellipsoid is None:
+            self.options['dub 3-D'].setCheckState(False)
+            self.status.showMessage("Error! Please, calibrate with heel and trim", 1000)
+        self.processor.tilt.enabled = bool(self.options['dub z'].checkState())
+        # 3-D calibration only on request, otherwise plain tilt compensation
+        self.processor.tilt.ellipsoid = self.ellipsoid if self.options['dub 3-D'].checkState() else None
+        self.processor.log.writer = self.log_writer_for(self.lineedit.text()) if self.logging_enable else None
+
+    def log_writer_for(self, path):
+        """ Return background writer of the log file, reopened if path was changed """
+        if self.log_writer is not None and self.log_writer.path != path:
+            self.close_log()
+        if self.log_writer is None:
+            from logwriter import LogWriter
+            self.log_writer = LogWriter(path)
+        return self.log_writer
+
+    def close_log(self):
+        if self.log_writer is not None:
+            if not self.log_writer.close():
+                self.status.showMessage("Log writer did not finish, the rest of the log may be lost", 5000)
+            self.show_log_status(self.log_writer)
+            self.log_writer = None
+
+    def show_log_status(self, writer):
+        text = "Log: {0} queued, {1} kB, {2} dropped".format(
+            writer.queue_depth, writer.bytes_written // 1024, writer.dropped)
+        if writer.error is not None:
+            text += ", error: {}".format(writer.error)
+        self.log_status.setText(text)
 
     def on_run(self, btn):
         name = btn.objectName()
@@ -462,18 +559,22 @@ class MagneticApp(MainWindow):
         # ...disable action rescan
         self.menus['file'].children()[1].setDisabled(True)
 
-        # Set selectable port to sensor
-        port = self.portbox.currentText()
-        self.serobj = serobj = serial.Serial(port, timeout=0.1)
-        self.sensor = sensor.Sensor(serobj)
-
-        # Run recieve data to single thread
-        self.t = threading.Thread(target=self.sensor.run, daemon=False)
-        self.t.start()
+        from acquisition import Acquisition
+        from processing import Processor
 
-        # Run timer
-        self.timer_recieve = self.startTimer(
-            self.TIMEOUT, timerType=QtCore.Qt.PreciseTimer)
+        # Set selectable port to sensor and run recieve data in reader thread
+        port = self.portbox.currentText()
+        self.acquisition = Acquisition([port])
+        self.acquisition.start()
+        self.sensor = self.acquisition.sensors[port]
+
+        # Process data at sensor rate, show it every TIMEOUT ms
+        self.processor = Processor(self.sensor, snapshot_interval=self.TIMEOUT / 1000.0,
+                                   snapshot_rows=self.SNAPSHOT_ROWS, on_snapshot=self.snapshot_ready.emit)
+        self.update_processor()
+        if self.compensate:
+            self.processor.collect.start(self.calibrate, self.log_writer_for(self.lineedit.text()))
+        self.processor.start()
 
         self.status.showMessage("Running")
         self.monitor_running = True
@@ -491,19 +592,16 @@ class MagneticApp(MainWindow):
         # ...enable action rescan
         self.menus['file'].children()[1].setEnabled(True)
 
-        # Kill timer
-        if self.timer_recieve:
-            self.killTimer(self.timer_recieve)
-            self.timer_recieve = None
-
-        # terminate thread
-        self.sensor.terminate()
-        self.t.join(timeout=0.1)
-
-        # Close port
-        self.serobj.close()
+        # Terminate reader and processing threads and close port
+        self.acquisition.stop()
+        self.processor.stop()
+        if self.compensate:
+            self.processor.collect.take()
         del self.sensor
 
+        # Write the rest of the log
+        self.close_log()
+
         self.monitor_running = False
 
     def on_clear(self):
@@ -517,9 +615,13 @@ class MagneticApp(MainWindow):
         elif btn_name == 'table':
             self.stack.setCurrentIndex(1)
         elif btn_name == 'compensate':
+            self.refresher.add(self.centralWidget().deviation_chart())
             self.stack.setCurrentIndex(2)
-            import subprocess
-            subprocess.run(["python", "magnetic_viewer.py"])
+            if self.viewer is None:
+                from magnetic_viewer import MagneticViewer
+                self.viewer = MagneticViewer()
+            self.viewer.show()
+            self.viewer.raise_()
         else:
             self.stack.setCurrentIndex(0)
 
@@ -531,20 +633,34 @@ class MagneticApp(MainWindow):
         if not self.compensate:
             self.toolbar_buttons['collection'].setText('Stop')
 
-            initial = float(self.data_view['heading'].text())
-            self.calibrate = Calibrate(initial)
+            from calibrate import Calibrate
+            initial = float(self.data_view.views['heading'].text())
+            self.calibrate = Calibrate(initial, cache=self.calibration_cache, sensor=self.portbox.currentText())
+            if self.processor is not None and self.processor.running:
+                self.processor.collect.start(self.calibrate, self.log_writer_for(self.lineedit.text()))
 
             self.compensate = True
             self.status.showMessage('Start compensate', 1000)
         else:
             self.toolbar_buttons['collection'].setText('Collection')
             self.progress.setValue(0)
-
-            self.maxdub = self.calibrate.compute()
+            if self.processor is not None:
+                self.processor.collect.take()
+
+            from algorithms import FixTable
+            self.maxdub = FixTable.from_correction(self.calibrate.compute())
+            self.profiles.save(self.portbox.currentText(), self.maxdub)
+            message = 'Stop compensate, {} outliers rejected'.format(self.calibrate.rejected)
+            # A level turn does not constrain the 3-D fit, the previous one is kept then
+            ellipsoid = self.calibrate.compute_ellipsoid()
+            if ellipsoid is not None:
+                self.ellipsoid = ellipsoid
+            else:
+                message += ', no 3-D calibration: {}'.format(self.calibrate.ellipsoid_error)
             del self.calibrate
 
             self.compensate = False
-            self.status.showMessage('Stop compensate', 1000)
+            self.status.showMessage(message, 5000)
 
     def turn_logging(self):
         """ On/Off logging. If logging ON then bottombar visible """
@@ -557,7 +673,8 @@ class MagneticApp(MainWindow):
 
     def on_set_chart_xinterval(self, interval):
         for chart in self.charts.values():
-            chart.set_xmax(interval)
+            if hasattr(chart, 'set_xmax'):
+                chart.set_xmax(interval)
 
     def on_select_path(self):
         ''' Select path to save log '''
@@ -579,15 +696,19 @@ class MagneticApp(MainWindow):
 
     def _action_quit(self):
         try:
-            self.sensor.terminate()
-            self.t.join(timeout=0.1)
+            self.acquisition.stop()
         except AttributeError:
             pass
+        if self.processor is not None:
+            self.processor.stop()
+        if self.refresher is not None:
+            self.refresher.stop()
+        self.close_log()
         QtCore.QCoreApplication.exit(0)
 
 
-def main():
-    app = QApplication(sys.argv)
+def main(argv=None):
+    app = QApplication(sys.argv if argv is None else argv)
 
     if sys.platform == 'win32':
         import ctypes
@@ -603,5 +724,4 @@ def main():
 
 
 if __name__ == '__main__':
-    args = get_arguments()
-    main()
+    main(sys.argv[:1] + qt_args)
@@ -9,9 +9,11 @@ class SensorDataModel(QAbstractTableModel):
     section_names = ("Roll", "Pitch", "Heading", "Hyr", "Hxr", "Hzr", "Hy", "Hx", "Hz")
     cols = len(section_names)
     
-    def __init__(self, data: list = None):
+    def __init__(self, data: list = None, max_rows=None):
         super().__init__()
         self._data = data or []
+        # extend_data() keeps only the last max_rows rows
+        self.max_rows = max_rows
 
         self.cell_color = Qt.white
         self.cell_color2 = Qt.white
@@ -29,6 +31,22 @@ class SensorDataModel(QAbstractTableModel):
         self._data.append(values)
         self.endInsertRows()
 
+    def extend_data(self, rows):
+        """ Append rows with a single insert notification, drop the oldest ones above max_rows """
+        if not rows:
+            return
+        if self.max_rows is not None:
+            rows = rows[-self.max_rows:]
+            excess = self.rowCount() + len(rows) - self.max_rows
+            if excess > 0:
+                self.beginRemoveRows(QModelIndex(), 0, excess - 1)
+                del self._data[:excess]
+                self.endRemoveRows()
+        r = self.rowCount()
+        self.beginInsertRows(QModelIndex(), r, r + len(rows) - 1)
+        self._data.extend(rows)
+        self.endInsertRows()
+
     def rowCount(self, parent=None, *args, **kwargs):
         if not self._data:
             return 0
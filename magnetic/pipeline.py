@@ -0,0 +1,231 @@
+""" Streaming processing of sensor data by composable stages
+
+    A batch is a numpy structured array of BATCH_DTYPE, one record per
+    DORIENT frame. Stages take a batch and return it (possibly modified or
+    filtered), Pipeline runs them in order:
+
+        pipeline = Pipeline([Round(1), Tilt(), Correct(FixTable(...)), Log(writer)])
+        for batch in recording_batches('session.rec'):
+            pipeline.process(batch)
+
+    The same stages run live in processing.Processor and headless in
+    cli.py --mode process.
+"""
+import threading
+import time
+
+import numpy
+from numpy.lib import recfunctions
+
+from algorithms import to_horizont_array
+from recording import Recording
+from sensor import PID_DORIENT, round_array
+
+# DORIENT values in order of the frame
+VALUES = ('roll', 'pitch', 'heading', 'hy_raw', 'hx_raw', 'hz_raw', 'hy', 'hx', 'hz')
+
+BATCH_DTYPE = numpy.dtype(
+    [('time', 'f8'), ('port', 'u1')] +
+    [(name, 'f8') for name in VALUES] +
+    # Filled by Tilt and Correct, nan until then
+    [('hy_h', 'f8'), ('hx_h', 'f8'), ('hz_h', 'f8'), ('heading_corrected', 'f8')])
+
+
+def make_batch(times, frames, port=0):
+    """ Batch of (N,) time.time() timestamps and (N, 9) DORIENT values """
+    batch = numpy.empty(len(frames), dtype=BATCH_DTYPE)
+    batch['time'] = times
+    batch['port'] = port
+    for i, name in enumerate(VALUES):
+        batch[name] = frames[:, i]
+    for name in ('hy_h', 'hx_h', 'hz_h', 'heading_corrected'):
+        batch[name] = numpy.nan
+    return batch
+
+
+def values(batch):
+    """ (N, 9) array of DORIENT values of a batch """
+    return recfunctions.structured_to_unstructured(batch[list(VALUES)])
+
+
+def timestamp_text(timestamp):
+    """ Format time.time() value as yyyy-MM-dd hh:mm:ss.zzz """
+    seconds = int(timestamp)
+    return "{0}.{1:03d}".format(
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(seconds)), int((timestamp - seconds) * 1000))
+
+
+class Stage(object):
+    """ Base of pipeline stages """
+
+    def process(self, batch):
+        return batch
+
+    def close(self):
+        pass
+
+
+class Round(Stage):
+    """ Round DORIENT values as the builtin round(value, ndigits) """
+
+    def __init__(self, ndigits=1):
+        self.ndigits = ndigits
+
+    def process(self, batch):
+        for name in VALUES:
+            batch[name] = round_array(batch[name], self.ndigits)
+        return batch
+
+
+class Tilt(Stage):
+    """ Tilt compensated fields hy_h, hx_h, hz_h, after 3-D correction by ellipsoid if it is given """
+
+    def __init__(self, ellipsoid=None, quantized=True):
+        self.ellipsoid = ellipsoid
+        self.quantized = quantized
+        self.enabled = True
+
+    def process(self, batch):
+        if not self.enabled or not len(batch):
+            return batch
+        args = batch['hy_raw'], batch['hx_raw'], batch['hz_raw'], batch['roll'], batch['pitch']
+        ellipsoid = self.ellipsoid
+        if ellipsoid is not None:
+            horizontal = ellipsoid.to_horizont(*args, quantized=self.quantized)
+        else:
+            horizontal = to_horizont_array(*args, quantized=self.quantized)
+        batch['hy_h'], batch['hx_h'], batch['hz_h'] = horizontal
+        return batch
+
+
+class Correct(Stage):
+    """ Heading corrected by a 2-D calibration (algorithms.FixTable, Algorithm, ...) """
+
+    def __init__(self, correction=None):
+        self.correction = correction
+
+    def process(self, batch):
+        correction = self.correction
+        if correction is not None and len(batch):
+            # Profiles are fitted on [x, y] = [hx, hy] (calibrate.Calibrate.data)
+            batch['heading_corrected'] = correction.correct_heading_array(
+                numpy.column_stack((batch['hx'], batch['hy'])))
+        return batch
+
+
+class Log(Stage):
+    """ Text log rows: time, pid, roll, pitch, heading, raw fields (tilt compensated if known), fields """
+
+    def __init__(self, writer=None):
+        self.writer = writer
+
+    def process(self, batch):
+        writer = self.writer
+        if writer is None or not len(batch):
+            return batch
+        logged = values(batch)
+        horizontal = recfunctions.structured_to_unstructured(batch[['hy_h', 'hx_h', 'hz_h']])
+        tilted = ~numpy.isnan(horizontal).any(axis=1)
+        logged[tilted, 3:6] = horizontal[tilted]
+        pid = hex(PID_DORIENT)
+        for timestamp, row in zip(batch['time'].tolist(), logged.tolist()):
+            writer.write(",".join([timestamp_text(timestamp), pid] + [str(x) for x in row]) + '\n')
+        return batch
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class Collect(Stage):
+    """ Collect samples to calibrate.Calibrate, [hy, hx] of them are logged to log_writer
+
+    The calibration is swapped from other threads by start() and take().
+    """
+
+    def __init__(self, calibrate=None, log_writer=None):
+        self.calibrate = calibrate
+        self.log_writer = log_writer
+        self._lock = threading.Lock()
+
+    def start(self, calibrate, log_writer=None):
+        with self._lock:
+            self.calibrate, self.log_writer = calibrate, log_writer
+
+    def take(self):
+        """ Stop collection, return the Calibrate """
+        with self._lock:
+            calibrate, self.calibrate, self.log_writer = self.calibrate, None, None
+        return calibrate
+
+    def status(self):
+        """ Return (coverage, estimate) of the calibration in progress, (None, None) without it """
+        with self._lock:
+            if self.calibrate is None:
+                return None, None
+            return self.calibrate.status(), self.calibrate.estimate()
+
+    def process(self, batch):
+        with self._lock:
+            if self.calibrate is None or self.calibrate.complete or not len(batch):
+                return batch
+            rows = values(batch)
+            for fed, row in enumerate(rows.tolist(), 1):
+                self.calibrate.update([PID_DORIENT] + row)
+                if self.calibrate.complete:
+                    # Collection is complete, the rest is neither collected nor logged
+                    rows = rows[:fed]
+                    break
+            if self.log_writer is not None:
+                for hy, hx in rows[:, 6:8].tolist():
+                    self.log_writer.write("{0},{1}\n".format(hy, hx))
+        return batch
+
+
+class Pipeline(object):
+    """ Stages applied in order to every batch """
+
+    def __init__(self, stages=()):
+        self.stages = list(stages)
+        self.batches = 0
+        self.frames = 0
+
+    def process(self, batch):
+        for stage in self.stages:
+            batch = stage.process(batch)
+        self.batches += 1
+        self.frames += len(batch)
+        return batch
+
+    def run(self, batches):
+        """ Process every batch of an iterable, yield the results """
+        for batch in batches:
+            yield self.process(batch)
+
+    def close(self):
+        for stage in self.stages:
+            stage.close()
+
+
+# Sources of batches
+
+def recording_batches(path, batch_frames=4096, start=None, end=None):
+    """ Yield batches of a recording.Recording, times are converted to time.time() """
+    rec = Recording(path)
+    frames = rec.frames(start, end)
+    for i in range(0, len(frames), batch_frames):
+        times, ports, decoded = rec.decode(frames[i:i + batch_frames])
+        batch = make_batch(rec.wall_time(times), decoded)
+        batch['port'] = ports
+        yield batch
+
+
+def sensor_batches(sensor, interval=0.02, duration=None, port=0):
+    """ Yield batches drained from a sensor.Sensor (monotonic times) every interval seconds """
+    offset = time.time() - time.monotonic()
+    stop = None if duration is None else time.monotonic() + duration
+    while stop is None or time.monotonic() < stop:
+        times, frames = sensor.drain()
+        if len(frames):
+            yield make_batch(times + offset, frames, port)
+        time.sleep(interval)
@@ -0,0 +1,109 @@
+""" Processing of sensor data off the GUI thread
+
+    Processor drains a sensor (anything with drain() -> (timestamps, frames))
+    in a worker thread at full rate and runs the frames through a
+    pipeline.Pipeline: rounding, heading correction, calibration collection,
+    tilt compensation and logging. Every snapshot_interval seconds it passes
+    a Snapshot to on_snapshot with the rows processed since the previous
+    one, evenly decimated to at most snapshot_rows, so the display rate does
+    not limit the processing and the GUI gets a bounded amount of work.
+"""
+import threading
+import time
+from collections import namedtuple
+
+import numpy
+
+from pipeline import Collect, Correct, Log, Pipeline, Round, Tilt, make_batch, values
+
+Snapshot = namedtuple('Snapshot', (
+    'rows',         # (N, 9) rounded frames [r, p, h, hy_raw, hx_raw, hz_raw, hy, hx, hz], decimated, last one included
+    'frames',       # frames processed since the previous snapshot
+    'heading',      # corrected heading of the last row or None
+    'coverage',     # angular coverage of the calibration in progress or None
+    'estimate',     # coefficients estimated by the calibration in progress or None
+    'overflows',    # frames lost in the sensor buffer
+))
+
+
+class Processor(object):
+    """ Worker thread processing frames of a sensor
+
+    Stages are configured from other threads by plain assignment:
+        correct.correction: calibration (algorithms.FixTable) for the heading or None
+        tilt.enabled, tilt.ellipsoid: log tilt compensated fields, 3-D calibration or None
+        log.writer: logwriter.LogWriter of the rows or None
+    Calibration is swapped by collect.start() and collect.take().
+    """
+
+    def __init__(self, source, interval=0.02, snapshot_interval=0.1, snapshot_rows=1000, on_snapshot=None):
+        self.source = source
+        self.interval = interval
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_rows = snapshot_rows
+        self.on_snapshot = on_snapshot
+
+        self.correct = Correct()
+        self.collect = Collect()
+        self.tilt = Tilt()
+        self.tilt.enabled = False
+        self.log = Log()
+        self.pipeline = Pipeline([Round(1), self.correct, self.collect, self.tilt, self.log])
+
+        self._pending = []
+        self._heading = None
+        self._running = False
+        self._thread = None
+
+    @property
+    def rows_processed(self):
+        return self.pipeline.frames
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self.run, name="processor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run(self):
+        next_snapshot = time.monotonic() + self.snapshot_interval
+        while self._running:
+            times, frames = self.source.drain()
+            if len(frames):
+                self.process(times, frames)
+
+            now = time.monotonic()
+            if now >= next_snapshot:
+                next_snapshot = max(next_snapshot + self.snapshot_interval, now)
+                self.snapshot()
+            time.sleep(max(0.0, min(self.interval, next_snapshot - time.monotonic())))
+        self.snapshot()
+
+    def process(self, times, frames):
+        """ Process (N,) monotonic timestamps and (N, 9) DORIENT frames """
+        batch = self.pipeline.process(make_batch(times + (time.time() - time.monotonic()), frames))
+        self._pending.append(values(batch))
+        heading = batch['heading_corrected'][-1]
+        self._heading = None if numpy.isnan(heading) else float(heading)
+
+    def snapshot(self):
+        """ Pass the rows processed since the previous snapshot to on_snapshot """
+        rows = numpy.concatenate(self._pending) if self._pending else numpy.empty((0, 9))
+        self._pending = []
+        frames = len(rows)
+        if frames > self.snapshot_rows:
+            rows = rows[numpy.linspace(0, frames - 1, self.snapshot_rows).round().astype(int)]
+        coverage, estimate = self.collect.status()
+        snapshot = Snapshot(rows, frames, self._heading, coverage, estimate, getattr(self.source, 'overflows', 0))
+        if self.on_snapshot is not None:
+            self.on_snapshot(snapshot)
+        return snapshot
@@ -0,0 +1,71 @@
+""" Saved calibration profiles, one JSON file per sensor (port or serial)
+
+        {"version": 1, "engine": "maxmin", "saved": 1700000000.0, "coefficients": {...}}
+
+    Profiles are loaded as algorithms.FixTable, so the live loop applies a
+    precomputed offset and 2x2 matrix. Coefficients are in the axis order
+    [x, y] = [hx, hy]: x_offset is the offset of hx, correct_array() takes
+    (N, 2) arrays of [hx, hy].
+"""
+import json
+import os
+import time
+
+from algorithms import FixTable
+from cache import sensor_filename
+
+VERSION = 1
+PROFILE_PATH = os.path.join(os.path.dirname(__file__), 'profiles')
+
+
+class ProfileStore(object):
+
+    def __init__(self, path=PROFILE_PATH):
+        self.path = path
+
+    def filename(self, sensor):
+        return sensor_filename(self.path, sensor)
+
+    def sensors(self):
+        """ Names of the files with profiles """
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+        return sorted(os.path.splitext(name)[0] for name in names if name.endswith('.json'))
+
+    def load(self, sensor):
+        """ Return FixTable of the sensor or None if it has no profile """
+        try:
+            with open(self.filename(sensor)) as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if content.get('version') != VERSION:
+            return None
+        table = FixTable.restore(content['coefficients'])
+        table.engine = content.get('engine')
+        return table
+
+    def save(self, sensor, correction, engine=None):
+        """ Save coefficients of a calibration (FixTable, Algorithm, EllipseAlgorithm) as profile of the sensor
+
+        engine is the name of the engine which fitted them, correction.engine by default.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        filename = self.filename(sensor)
+        content = {
+            'version': VERSION,
+            'engine': engine or correction.engine,
+            'saved': time.time(),
+            'coefficients': correction.coefficients(),
+        }
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(content, f, indent=2)
+        os.replace(filename + '.tmp', filename)
+
+    def delete(self, sensor):
+        try:
+            os.remove(self.filename(sensor))
+        except FileNotFoundError:
+            pass
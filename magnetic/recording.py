@@ -0,0 +1,178 @@
+""" Binary recording of raw DORIENT frames
+
+    File layout:
+        header   HEADER_SIZE bytes (magic, version, record size, index interval, clocks)
+        records  RECORD_DTYPE, 32 bytes each
+
+    Every index_interval frames are preceded by an index record (kind=1)
+    holding the number of frames before it and the time of the next frame,
+    so the file is read through numpy.memmap and sliced by time range
+    without parsing it. Payloads are kept as received and are re-decoded
+    losslessly by sensor.decode_dorient.
+"""
+import os
+import struct
+import threading
+import time
+
+import numpy
+
+from sensor import DORIENT, decode_dorient, frame_dorient
+
+MAGIC = b'MAGREC\x00\x01'
+VERSION = 1
+HEADER = struct.Struct('<8sHHIdd')
+HEADER_SIZE = 64
+INDEX_INTERVAL = 4096
+
+KIND_FRAME = 0
+KIND_INDEX = 1
+
+RECORD_DTYPE = numpy.dtype([
+    ('time', '<f8'),
+    ('port', 'u1'),
+    ('kind', 'u1'),
+    ('payload', 'u1', (DORIENT.size,)),
+    ('reserved', 'u1', (4,)),
+])
+
+
+class RecordWriter(object):
+    """ Append raw frames to a recording, shared by the reader threads of several ports
+
+    Times are time.monotonic() values, they are kept non-decreasing in the file.
+    """
+
+    def __init__(self, path, index_interval=INDEX_INTERVAL):
+        self.path = path
+        self.index_interval = index_interval
+        self.frames = 0
+        self.bytes_written = 0
+
+        self._last_time = 0.0
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb')
+        header = HEADER.pack(MAGIC, VERSION, RECORD_DTYPE.itemsize, index_interval, time.time(), time.monotonic())
+        self._write(header.ljust(HEADER_SIZE, b'\x00'))
+
+    def _write(self, data):
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+    def write(self, port, payloads, timestamp=None):
+        """ Append concatenated DORIENT payloads received from port at timestamp """
+        n = len(payloads) // DORIENT.size
+        if not n:
+            return
+        with self._lock:
+            timestamp = max(time.monotonic() if timestamp is None else timestamp, self._last_time)
+            self._last_time = timestamp
+
+            frames = numpy.zeros(n, dtype=RECORD_DTYPE)
+            frames['time'] = timestamp
+            frames['port'] = port
+            frames['payload'] = numpy.frombuffer(payloads, dtype=numpy.uint8, count=n * DORIENT.size).reshape(n, -1)
+
+            # Index record goes before every index_interval-th frame
+            first = self.frames
+            index_at = numpy.arange(-first % self.index_interval, n, self.index_interval)
+            index = numpy.zeros(len(index_at), dtype=RECORD_DTYPE)
+            index['time'] = timestamp
+            index['kind'] = KIND_INDEX
+            index['payload'][:, :8] = (first + index_at).astype('<u8').view(numpy.uint8).reshape(-1, 8)
+            records = numpy.insert(frames, index_at, index)
+
+            self._write(records.tobytes())
+            self.frames += n
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Recording(object):
+    """ Read-only memory-mapped recording """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)[:HEADER.size]
+        if len(header) < HEADER.size:
+            raise ValueError("{} is not a recording".format(path))
+        magic, version, record_size, index_interval, created, clock = HEADER.unpack(header)
+        if magic != MAGIC or record_size != RECORD_DTYPE.itemsize:
+            raise ValueError("{} is not a recording".format(path))
+
+        self.version = version
+        self.index_interval = index_interval
+        # time.time() and time.monotonic() at the moment of creation
+        self.created = created
+        self.clock = clock
+
+        # A partially written last record is ignored
+        n = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+        if n > 0:
+            self.records = numpy.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(n,))
+        else:
+            self.records = numpy.zeros(0, dtype=RECORD_DTYPE)
+        if n > 0 and self.records['kind'][-1] == KIND_INDEX:
+            # Writer stopped right after an index record
+            self.records = self.records[:-1]
+
+    def __len__(self):
+        return len(self.records) - len(self.index)
+
+    @property
+    def index(self):
+        """ Index records: every (index_interval + 1)-th record """
+        return self.records[::self.index_interval + 1]
+
+    def wall_time(self, timestamps):
+        """ Convert monotonic timestamps of the recording to time.time() values """
+        return numpy.asarray(timestamps) - self.clock + self.created
+
+    def frames(self, start=None, end=None):
+        """ Return records of frames with start <= time < end (monotonic times) """
+        block = self.index_interval + 1
+        index_times = self.index['time']
+        first = 0
+        last = len(self.records)
+        if start is not None:
+            first = max(0, numpy.searchsorted(index_times, start, side='left') - 1) * block
+        if end is not None:
+            last = min(last, numpy.searchsorted(index_times, end, side='left') * block)
+
+        records = self.records[first:last]
+        times = records['time']
+        lo = 0 if start is None else numpy.searchsorted(times, start, side='left')
+        hi = len(records) if end is None else numpy.searchsorted(times, end, side='left')
+        records = records[lo:hi]
+        return numpy.array(records[records['kind'] == KIND_FRAME])
+
+    def decode(self, frames=None):
+        """ Return (timestamps, port ids, (N, 9) DORIENT values) of frames (default all) """
+        if frames is None:
+            frames = self.frames()
+        return frames['time'], frames['port'], decode_dorient(frames['payload'].tobytes())
+
+    def chunks(self, frames=None, chunk_frames=256):
+        """ Yield (time, stream bytes) of frames relative to the first one, for replay by SimulatedBus """
+        if frames is None:
+            frames = self.frames()
+        if not len(frames):
+            return
+        t0 = frames['time'][0]
+        stream = frame_dorient(frames['payload'].tobytes()).reshape(len(frames), -1)
+        for i in range(0, len(frames), chunk_frames):
+            j = min(i + chunk_frames, len(frames))
+            yield frames['time'][j - 1] - t0, stream[i:j].tobytes()
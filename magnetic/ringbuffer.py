@@ -0,0 +1,70 @@
+import threading
+
+import numpy
+
+
+class RingBuffer(object):
+    """ Preallocated buffer of timestamped rows shared between a producer and a consumer thread
+
+    The producer appends with extend(), the consumer takes every row received
+    since its previous call with drain(). When the consumer falls behind by
+    more than capacity rows the oldest rows are overwritten and counted in
+    overflows.
+    """
+
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.width = width
+        self.times = numpy.zeros(capacity)
+        self.values = numpy.zeros((capacity, width))
+
+        self.received = 0
+        self.overflows = 0
+
+        self._head = 0
+        self._tail = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return self._head - self._tail
+
+    def append(self, timestamp, row):
+        self.extend(timestamp, numpy.asarray(row, dtype=float).reshape(1, self.width))
+
+    def extend(self, timestamps, rows):
+        """ Append rows, timestamps is an array of len(rows) or a single time for all rows """
+        n = len(rows)
+        if not n:
+            return
+        timestamps = numpy.broadcast_to(timestamps, (n,))
+        with self._lock:
+            if n > self.capacity:
+                self.overflows += n - self.capacity
+                self._tail += n - self.capacity
+                self._head += n - self.capacity
+                self.received += n - self.capacity
+                timestamps, rows = timestamps[-self.capacity:], rows[-self.capacity:]
+                n = self.capacity
+
+            index = numpy.arange(self._head, self._head + n) % self.capacity
+            self.times[index] = timestamps
+            self.values[index] = rows
+            self._head += n
+            self.received += n
+
+            lost = self._head - self._tail - self.capacity
+            if lost > 0:
+                self.overflows += lost
+                self._tail += lost
+
+    def drain(self):
+        """ Return (timestamps, rows) of every row appended since the previous drain """
+        with self._lock:
+            index = numpy.arange(self._tail, self._head) % self.capacity
+            self._tail = self._head
+            return self.times[index], self.values[index]
+
+    def clear(self):
+        with self._lock:
+            self._tail = self._head
@@ -1,11 +1,13 @@
 import threading
 import time
-import queue
-from queue import Queue
+import struct
 
+import numpy
 import serial
 import serial.tools.list_ports as tools
 
+from ringbuffer import RingBuffer
+
 # Логгирование
 import sys
 import logging
@@ -41,21 +43,60 @@ def tesla2gauss(tesla):
 	return (int(tesla * 65536.0 / 750.0)).to_bytes(2, byteorder='little', signed=True)
 
 
+PID_DORIENT = 112
+
+# DORIENT payload: roll, pitch, heading (unsigned), magc_raw, magb_raw, magz_raw, magc, magb, magz
+DORIENT = struct.Struct('<hhHhhhhhh')
+DORIENT_SCALES = (359.9, 359.9, 359.9, 750.0, 750.0, 750.0, 750.0, 750.0, 750.0)
+DORIENT_FIELDS = len(DORIENT_SCALES)
+
+
 def parse_dorient(message):
-	fields = [message[2 * i: 2 * (i + 1)] for i in range(9)]
-	roll = kang2dec(fields[0])
-	pitch = kang2dec(fields[1])
-	heading = kang2dec(fields[2], signed=False)
-	magc_raw = gauss2tesla(fields[3])
-	magb_raw = gauss2tesla(fields[4])
-	magz_raw = gauss2tesla(fields[5])
-	magc = gauss2tesla(fields[6])
-	magb = gauss2tesla(fields[7])
-	magz = gauss2tesla(fields[8])
-	return roll, pitch, heading, magc_raw, magb_raw, magz_raw, magc, magb, magz
+	if len(message) == DORIENT.size:
+		values = DORIENT.unpack(message)
+	else:
+		# Truncated or oversized payload: decode whatever bytes are present
+		values = [int.from_bytes(message[2 * i: 2 * (i + 1)], byteorder='little', signed=(i != 2))
+			for i in range(DORIENT_FIELDS)]
+	return tuple(round(value * scale / 65536.0, 3) for value, scale in zip(values, DORIENT_SCALES))
+
+
+def round_array(values, ndigits):
+	""" Vectorized round(value, ndigits) giving the same result as the builtin
+
+	numpy.round scales by 10**ndigits and may differ from the builtin in the last digit
+	near halfway points, so these few values are rounded by the builtin.
+	"""
+	result = numpy.round(values, ndigits)
+	scaled = values * 10.0 ** ndigits
+	near_half = numpy.abs(scaled - numpy.floor(scaled) - 0.5) < 1e-6
+	if near_half.any():
+		result[near_half] = [round(value, ndigits) for value in values[near_half].tolist()]
+	return result
 
 
-SENSOR_QUEUE = Queue(maxsize=1)
+def round3(values):
+	""" Vectorized round(value, 3), see round_array """
+	return round_array(values, 3)
+
+
+def decode_dorient(payloads):
+	""" Decode N concatenated DORIENT payloads into an (N, 9) float array
+
+	Gives the same values as parse_dorient applied to each payload.
+	"""
+	raw = numpy.frombuffer(payloads, dtype='<i2').reshape(-1, DORIENT_FIELDS).astype(numpy.int32)
+	raw[:, 2] &= 0xFFFF
+	return round3(raw * numpy.array(DORIENT_SCALES) / 65536.0)
+
+
+def encode_dorient(frames):
+	""" Encode (N, 9) array of DORIENT values into N concatenated payloads """
+	raw = numpy.rint(numpy.asarray(frames, dtype=float) * 65536.0 / numpy.array(DORIENT_SCALES))
+	raw[:, 2] %= 65536
+	raw = raw.astype(numpy.int64)
+	raw[:, 2] -= (raw[:, 2] >= 32768) * 65536
+	return numpy.clip(raw, -32768, 32767).astype('<i2').tobytes()
 
 
 class SensorDriver(object):
@@ -73,73 +114,177 @@ class SensorDriver(object):
 		pass
 
 
+class FrameDecoder(object):
+	""" Incremental decoder of frames 0d 0a 7e | pid | size | payload | trailer
+
+	Bytes are accumulated in a reusable buffer, the sync is found with
+	bytearray.find and payloads are returned as memoryview slices of the buffer.
+	A payload view is only valid until the next frame is requested.
+
+	A frame is consumed as soon as it is yielded. An iterator abandoned
+	before its end is closed by the next feed(), which trims the buffer.
+	"""
+	SYNC = b'\r\n~'
+	HEADER_SIZE = 5
+	TRAILER_SIZE = 1
+
+	def __init__(self):
+		self._buffer = bytearray()
+		self._iterator = None
+		self.frames = 0
+		self.skipped = 0
+
+	def reset(self):
+		self._close_iterator()
+		self._buffer = bytearray()
+
+	def feed(self, data):
+		""" Append received bytes and return iterator of (pid, payload) for each complete frame """
+		self._close_iterator()
+		self._buffer += data
+		self._iterator = self._frames()
+		return self._iterator
+
+	def _close_iterator(self):
+		if self._iterator is not None:
+			self._iterator.close()
+			self._iterator = None
+
+	def _frames(self):
+		buf = self._buffer
+		pos = 0
+		view = memoryview(buf)
+		try:
+			while True:
+				start = buf.find(self.SYNC, pos)
+				if start < 0:
+					# Keep a tail that may be the beginning of the next sync
+					tail = max(pos, len(buf) - len(self.SYNC) + 1)
+					self.skipped += tail - pos
+					pos = tail
+					break
+
+				self.skipped += start - pos
+				pos = start
+				if start + self.HEADER_SIZE > len(buf):
+					break
+
+				pid = buf[start + 3]
+				size = buf[start + 4]
+				end = start + self.HEADER_SIZE + size
+				if end + self.TRAILER_SIZE > len(buf):
+					break
+
+				payload = view[start + self.HEADER_SIZE:end]
+				self.frames += 1
+				pos = end + self.TRAILER_SIZE
+				try:
+					yield pid, payload
+				finally:
+					payload.release()
+		finally:
+			view.release()
+			del buf[:pos]
+
+
+DORIENT_FRAME_SIZE = FrameDecoder.HEADER_SIZE + DORIENT.size + FrameDecoder.TRAILER_SIZE
+
+
+def frame_dorient(payloads):
+	""" Wrap N concatenated DORIENT payloads into frames, return uint8 array of the stream """
+	payloads = numpy.frombuffer(payloads, dtype=numpy.uint8).reshape(-1, DORIENT.size)
+	frames = numpy.zeros((len(payloads), DORIENT_FRAME_SIZE), dtype=numpy.uint8)
+	frames[:, :3] = numpy.frombuffer(FrameDecoder.SYNC, dtype=numpy.uint8)
+	frames[:, 3] = PID_DORIENT
+	frames[:, 4] = DORIENT.size
+	frames[:, FrameDecoder.HEADER_SIZE:-FrameDecoder.TRAILER_SIZE] = payloads
+	return frames.reshape(-1)
+
+
+class DorientDecoder(FrameDecoder):
+	""" FrameDecoder which keeps DORIENT frames only and decodes them in batch """
+
+	def __init__(self):
+		super().__init__()
+		self.errors = 0
+		self.bytes_received = 0
+
+	def collect(self, data):
+		""" Return concatenated raw payloads of DORIENT frames completed by received bytes """
+		self.bytes_received += len(data)
+		payloads = bytearray()
+		for pid, payload in self.feed(data):
+			if pid != PID_DORIENT:
+				continue
+			if len(payload) == DORIENT.size:
+				payloads += payload
+			else:
+				self.errors += 1
+		return payloads
+
+	def decode(self, data):
+		""" Return (N, 9) array of DORIENT frames completed by received bytes """
+		return decode_dorient(self.collect(data))
+
+
 class Sensor(object):
 	SOP1 = bytes.fromhex("0d")
 	SOP2 = bytes.fromhex("0a")
 	SOP3 = bytes.fromhex("7e")
 
-	def __init__(self, bus):
+	PID_DORIENT = PID_DORIENT
+	BUFFER_SIZE = 16384
+
+	def __init__(self, bus, buffer_size=BUFFER_SIZE, recorder=None, port_id=0):
 		self.bus = bus
+		self.recorder = recorder
+		self.port_id = port_id
+		self.decoder = DorientDecoder()
+		self.buffer = RingBuffer(buffer_size, DORIENT_FIELDS)
+		self._errors = 0
 		self._running = True
-		self._full_queue = 0
 
-	def recieve(self):
-		return SENSOR_QUEUE.get()
+	@property
+	def errors(self):
+		return self._errors + self.decoder.errors
+
+	@property
+	def bytes_received(self):
+		return self.decoder.bytes_received
+
+	@property
+	def overflows(self):
+		return self.buffer.overflows
+
+	def drain(self):
+		""" Return (timestamps, frames) of every DORIENT frame decoded since the previous call """
+		return self.buffer.drain()
 	
 	def terminate(self):
 		self._running = False
-	
+
+	def read_chunk(self):
+		""" Read everything waiting in the port buffer (at least one byte) """
+		waiting = getattr(self.bus, 'in_waiting', 0)
+		return self.bus.read(max(waiting, 1))
+
 	def run(self):
 		""" This function used to read any message from sensor"""
 		logger.debug("port thread running")
-		message = b''
-		start = 0
-		pid = 0
-		size = 0
-		
 		while self._running:
 			try:
-				buf = self.bus.read(1)
+				chunk = self.read_chunk()
 			except serial.SerialException:
 				logger.exception("no serial port")
-				SENSOR_QUEUE.put(object())
-
-			if start == 0:
-				if buf == self.SOP1:
-					start += 1
-				else:
-					start = 0
-			elif start == 1:
-				if buf == self.SOP2:
-					start += 1
-				else:
-					start = 0
-			elif start == 2:
-				if buf == self.SOP3:
-					start += 1
-				else:
-					start = 0
-			elif start == 3:
-				pid = int.from_bytes(buf, byteorder='little')
-				start = 4
-			elif start == 4:
-				size = int.from_bytes(buf, byteorder='little')
-				start = 5
-			elif start == 5:
-				if len(message) < size:
-					message += buf
-				else:
-					if pid == 112:
-						data = [pid]
-						data.extend(parse_dorient(message))
-						try:
-							SENSOR_QUEUE.put(data, block=False)
-						except queue.Full:
-							logger.debug("input queue is full")
-					start = 0
-					message = b''
-			else:
-				logger.error("in sensor.readany()")
+				self._errors += 1
+				break
+
+			received = time.monotonic()
+			payloads = self.decoder.collect(chunk)
+			if payloads:
+				self.buffer.extend(received, decode_dorient(payloads))
+				if self.recorder is not None:
+					self.recorder.write(self.port_id, payloads, received)
 		logger.debug("port thread stop")
 
 
@@ -155,8 +300,9 @@ def debug():
 	
 	try:
 		while True:
-			data = sensor.recieve()
-			print(data)
+			_, frames = sensor.drain()
+			if len(frames):
+				print(len(frames), frames[-1])
 			time.sleep(0.1)
 	except KeyboardInterrupt as e:
 		sensor.terminate()
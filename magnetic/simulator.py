@@ -0,0 +1,250 @@
+""" Hardware-free sources of sensor data
+
+    Simulator generates DORIENT frames of a compass rotating in a magnetic
+    field distorted by hard and soft iron, Replay streams a raw capture.
+    The chunks() of both are used through SimulatedBus (in place of
+    serial.Serial) or PtyServer (a pseudo terminal for serial.Serial or
+    AsyncSensor).
+"""
+import os
+import select
+import threading
+import time
+import tty
+
+import numpy
+
+from sensor import DORIENT_FRAME_SIZE, encode_dorient, frame_dorient
+
+
+def tilt_matrices(roll_grad, pitch_grad):
+    """ Return (N, 3, 3) rotations from sensor (x, y, z) to horizontal (xh, yh, zh), see to_horizont """
+    r = numpy.radians(roll_grad)
+    p = numpy.radians(-numpy.asarray(pitch_grad))
+    cr, sr, cp, sp = numpy.cos(r), numpy.sin(r), numpy.cos(p), numpy.sin(p)
+    zero = numpy.zeros_like(r)
+    return numpy.stack((
+        numpy.stack((cp, -sp * sr, sp * cr), axis=-1),
+        numpy.stack((zero, cr, sr), axis=-1),
+        numpy.stack((sp, sr * cp, -cp * cr), axis=-1),
+    ), axis=-2)
+
+
+def soft_iron_matrix(k, phi_grad):
+    """ 3x3 soft iron matrix, horizontal field is squeezed by k along the axis rotated by phi """
+    phi = numpy.radians(phi_grad)
+    c, s = numpy.cos(phi), numpy.sin(phi)
+    rotate = numpy.array([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]])
+    return rotate @ numpy.diag((1.0, k, 1.0)) @ rotate.T
+
+
+class Simulator(object):
+    """ Source of DORIENT frames from an ellipse (hard/soft iron) model
+
+    rate: frames per second
+    horizontal, vertical: earth field components
+    offset: hard iron (x, y, z) offset
+    soft_iron: 3x3 matrix, by default soft_iron_matrix(k, phi)
+    rotation: heading speed in grad/s, or schedule(t) -> heading in grad
+    roll, pitch: amplitude in grad of a sinusoidal swing with period swing_period
+    noise: standard deviation of gaussian noise of the fields
+    corrupt: probability of every byte of the stream to be replaced by a random byte
+    """
+
+    def __init__(self, rate=100.0, horizontal=20.0, vertical=40.0, offset=(3.0, -2.0, 0.0),
+                 k=0.8, phi=30.0, soft_iron=None, rotation=10.0, schedule=None,
+                 roll=0.0, pitch=0.0, swing_period=10.0, noise=0.0, corrupt=0.0, seed=None):
+        self.rate = rate
+        self.horizontal = horizontal
+        self.vertical = vertical
+        self.offset = numpy.asarray(offset, dtype=float)
+        self.soft_iron = soft_iron_matrix(k, phi) if soft_iron is None else numpy.asarray(soft_iron, dtype=float)
+        self.schedule = schedule or (lambda t: rotation * t)
+        self.roll = roll
+        self.pitch = pitch
+        self.swing_period = swing_period
+        self.noise = noise
+        self.corrupt = corrupt
+        self.random = numpy.random.default_rng(seed)
+
+    def values(self, t):
+        """ Return (N, 9) DORIENT values at times t """
+        t = numpy.asarray(t, dtype=float)
+        heading = numpy.radians(numpy.asarray(self.schedule(t), dtype=float) * numpy.ones_like(t))
+        swing = numpy.sin(2 * numpy.pi * t / self.swing_period)
+        roll = self.roll * swing
+        pitch = self.pitch * numpy.cos(2 * numpy.pi * t / self.swing_period)
+
+        # Earth field in horizontal frame: heading = atan2(-yh, xh)
+        earth = numpy.stack((
+            self.horizontal * numpy.cos(heading),
+            -self.horizontal * numpy.sin(heading),
+            numpy.full_like(t, self.vertical)), axis=-1)
+
+        tilt = tilt_matrices(roll, pitch)
+        body = numpy.einsum('nji,nj->ni', tilt, earth)
+        body = body @ self.soft_iron.T + self.offset
+        if self.noise:
+            body += self.random.normal(0.0, self.noise, body.shape)
+
+        # Uncompensated compass heading
+        horizontal = numpy.einsum('nij,nj->ni', tilt, body)
+        measured = numpy.degrees(numpy.arctan2(-horizontal[:, 1], horizontal[:, 0])) % 360.0
+
+        x, y, z = body.T
+        return numpy.column_stack((roll, pitch, measured, y, x, z, y, x, z))
+
+    def frames(self, t):
+        """ Return stream bytes of DORIENT frames at times t """
+        data = frame_dorient(encode_dorient(self.values(t)))
+        if self.corrupt:
+            count = self.random.binomial(len(data), self.corrupt)
+            data[self.random.integers(0, len(data), count)] = self.random.integers(0, 256, count)
+        return data.tobytes()
+
+    def chunks(self, chunk_frames=None, duration=None):
+        """ Yield (time, bytes) with frames up to time, endless unless duration is given """
+        chunk_frames = chunk_frames or max(1, int(self.rate / 100))
+        start = 0
+        while duration is None or start / self.rate < duration:
+            n = chunk_frames
+            if duration is not None:
+                n = min(n, int(duration * self.rate) - start) or 1
+            t = numpy.arange(start, start + n) / self.rate
+            yield t[-1], self.frames(t)
+            start += n
+
+
+class Replay(object):
+    """ Source of a raw capture of the sensor stream
+
+    The capture has no timestamps, it is paced by byte_rate
+    (by default rate frames of DORIENT_FRAME_SIZE bytes per second).
+    """
+
+    def __init__(self, path, rate=100.0, byte_rate=None, chunk_size=4096):
+        self.path = path
+        self.byte_rate = byte_rate or rate * DORIENT_FRAME_SIZE
+        self.chunk_size = chunk_size
+
+    def chunks(self):
+        position = 0
+        with open(self.path, 'rb') as f:
+            while True:
+                data = f.read(self.chunk_size)
+                if not data:
+                    return
+                position += len(data)
+                yield position / self.byte_rate, data
+
+
+class SimulatedBus(object):
+    """ File-like replacement of serial.Serial fed by chunks() of a source
+
+    Chunks are released when their time has come (divided by speed),
+    speed=None releases them as fast as they are read.
+    """
+
+    def __init__(self, chunks, speed=1.0, timeout=0.1, port='simulator'):
+        self.port = port
+        self.timeout = timeout
+        self.speed = speed
+        self.is_open = True
+
+        self._chunks = iter(chunks)
+        self._pending = None
+        self._buffer = bytearray()
+        self._start = None
+
+    @property
+    def in_waiting(self):
+        self._release()
+        return len(self._buffer)
+
+    def _release(self):
+        if self._start is None:
+            self._start = time.monotonic()
+        now = time.monotonic() - self._start
+        while True:
+            if self._pending is None:
+                self._pending = next(self._chunks, None)
+                if self._pending is None:
+                    return
+            at, data = self._pending
+            if self.speed is not None and at / self.speed > now:
+                return
+            self._buffer += data
+            self._pending = None
+            if self.speed is None:
+                return
+
+    def read(self, size=1):
+        deadline = time.monotonic() + (self.timeout or 0.0)
+        self._release()
+        while not self._buffer and time.monotonic() < deadline:
+            if self._pending is None:
+                # Source is exhausted, behave like a silent port
+                time.sleep(max(0.0, deadline - time.monotonic()))
+                break
+            at, _ = self._pending
+            wait = self._start + at / self.speed - time.monotonic()
+            time.sleep(max(0.0, min(wait, deadline - time.monotonic())))
+            self._release()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def close(self):
+        self.is_open = False
+
+
+class PtyServer(object):
+    """ Pseudo terminal writing chunks() of a source in real time, port is the name of the slave side """
+
+    def __init__(self, chunks, speed=1.0):
+        self.chunks = chunks
+        self.speed = speed
+        self.master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        # Writes never block, stop() works when nobody reads the port
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self._slave)
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self.master)
+        os.close(self._slave)
+
+    def run(self):
+        start = time.monotonic()
+        for at, data in self.chunks:
+            if not self._running:
+                break
+            if self.speed is not None:
+                time.sleep(max(0.0, start + at / self.speed - time.monotonic()))
+            if not self._write(data):
+                break
+
+    def _write(self, data):
+        """ Write all of data unless stopped, return False if stopped or the pty is closed """
+        data = memoryview(data)
+        while data:
+            if not self._running:
+                return False
+            try:
+                data = data[os.write(self.master, data):]
+            except BlockingIOError:
+                # Buffer of the pty is full, wait until the reader takes something
+                select.select([], [self.master], [], 0.1)
+            except OSError:
+                return False
+        return True
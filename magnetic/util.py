@@ -1,14 +1,14 @@
 import argparse
 import csv
 
-from openpyxl import load_workbook, Workbook
-
 PATH_DS = '../downloads/example_dataset.xlsx'
 SHEET = ''
 
 # Excel
 # TODO: Write convertor test data to csv file
 def from_excel(path, sheet_name, rangex, rangey):
+	# openpyxl is slow to import, it is loaded on the first use
+	from openpyxl import load_workbook
 	wb = load_workbook(filename=path)
 	sheet = wb[sheet_name]
 	dataset = []
@@ -19,6 +19,7 @@ def from_excel(path, sheet_name, rangex, rangey):
 
 # TODO: Write save dataset to .xlsx
 def to_excel(path=None):
+	from openpyxl import Workbook
 	wb = Workbook()
 	ws = wb.active
 	ws['A1'] = 42
@@ -39,8 +40,23 @@ def to_csv(fname, data, mode='w'):
 		writer.writerows(data)
 
 
-def get_arguments():
+def get_arguments(args=None, known=False):
+	""" Parse arguments, with known=True return (arguments, the rest) and leave the rest to Qt """
 	p = argparse.ArgumentParser()
-	p.add_argument('--mode', action='store', dest='mode', default=None)
-	p.add_argument('--data', action='store', dest='path_to_dataset', default=None)
-	return p.parse_args()
+	p.add_argument('--mode', action='store', dest='mode', default=None,
+		help="headless mode: record, apply, process or stats (default: start the GUI)")
+	p.add_argument('--data', action='store', dest='path_to_dataset', default=None,
+		help="recording (.rec) or CSV to apply calibration to, to process or to summarize")
+	p.add_argument('--port', action='append', dest='ports', default=None,
+		help="port to record, repeat for several ports (default: every available), or to process")
+	p.add_argument('--output', action='store', dest='output', default=None,
+		help="recording to write (record), CSV or .npy to write (apply), text log to write (process)")
+	p.add_argument('--profile', action='store', dest='profile', default=None,
+		help="sensor of the saved calibration profile to apply")
+	p.add_argument('--duration', action='store', dest='duration', type=float, default=None,
+		help="seconds to record or to process a port (default: until Ctrl-C)")
+	p.add_argument('--tilt', action='store_true', dest='tilt', default=False,
+		help="log tilt compensated fields (process)")
+	if known:
+		return p.parse_known_args(args)
+	return p.parse_args(args)